@@ -3,40 +3,1555 @@
 
 import os
 import sys
+import errno
 import curses
 import shutil
 import subprocess
 import locale
 import json
+import argparse
+import re
+import time
+import stat
+import bisect
+import struct
+import ctypes
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from collections import OrderedDict, deque
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:  # Windows: клонирование (FICLONE) недоступно
+    fcntl = None
+
 # Файл для сохранения последнего посещенного каталога
 CD_FILE = os.path.expanduser("~/.tui_fm_last_dir")
 # Файл для сохранения позиций курсора по директориям
 CURSOR_POSITIONS_FILE = os.path.expanduser("~/.tui_fm_cursor_positions")
+# Лимит памяти кэша листингов в мегабайтах
+try:
+    LISTING_CACHE_MB = max(0, int(os.environ.get('GFD_LISTING_CACHE_MB', '64')))
+except ValueError:
+    LISTING_CACHE_MB = 64
+# Каталоги, изменённые недавно, не кэшируем: на ФС с грубым mtime
+# (секундным, как на NFS/ext3) следующее изменение может не сдвинуть mtime
+LISTING_CACHE_RACY_NS = 2 * 10**9
+# Период опроса inotify во время ожидания клавиши (мс)
+WATCH_POLL_MS = 200
+# Потоковое чтение больших директорий: сколько ждать полного листинга
+# перед первой отрисовкой (с), размер порции и период подмешивания (мс)
+STREAM_FIRST_WAIT = 0.05
+STREAM_BATCH = 4096
+STREAM_POLL_MS = 50
+# Предварительное чтение директории под курсором: задержка после остановки
+# курсора (с), число потоков, nice потоков и предел размера директории
+PREFETCH_DWELL = 0.15
+PREFETCH_WORKERS = 2
+PREFETCH_NICE = 10
+PREFETCH_MAX_ENTRIES = 100000
+PREFETCH_POLL_MS = 50
+# Фоновые файловые операции (вставка): число рабочих потоков и опрос завершения (мс)
+JOB_WORKERS = 2
+JOB_POLL_MS = 100
+# Порция копирования через буфер в памяти и порция копирования внутри ядра
+# (copy_file_range/sendfile); минимальный интервал перерисовки прогресса (с)
+COPY_CHUNK = 4 * 1024 * 1024
+KERNEL_COPY_CHUNK = 64 * 1024 * 1024
+# Потоки копирования файлов внутри одного дерева (parallel_copytree), не меньше одного
+try:
+    COPY_WORKERS = max(1, int(os.environ.get('GFD_COPY_WORKERS', '8')))
+except ValueError:
+    COPY_WORKERS = 8
+JOB_PROGRESS_INTERVAL = 0.25
+# Сколько ключей сопоставления (strxfrm) держать в одном поколении кэша
+COLLATION_CACHE_ENTRIES = 500000
+# Удержание стрелок: нажатия чаще KEY_REPEAT_GAP (с) считаются автоповтором,
+# каждые KEY_ACCEL_EVERY повторов шаг растёт на строку, но не больше KEY_ACCEL_MAX
+KEY_REPEAT_GAP = 0.1
+KEY_ACCEL_EVERY = 10
+KEY_ACCEL_MAX = 16
+# Нечёткий фильтр ('/'): до FILTER_SYNC_LIMIT кандидатов фильтруем сразу,
+# больше — в фоновом потоке порциями по FILTER_CHUNK; опрос результатов в мс
+FILTER_SYNC_LIMIT = 50000
+FILTER_CHUNK = 20000
+FILTER_POLL_MS = 30
+# Отладочная панель времени кадра ('D'): сколько последних замеров хранить на фазу
+FRAME_STATS_SAMPLES = 512
 
 # Включаем поддержку локали для корректного отображения Unicode (в том числе кириллицы)
 locale.setlocale(locale.LC_ALL, '')
 
-class FileManager:
+
+class CollationKeys:
+    """
+    Ключи сортировки имён по правилам локали (LC_COLLATE). locale.strxfrm
+    вызывается один раз на имя: ключи хранятся в двух поколениях словарей
+    и переживают перечитывание директорий, а память остаётся ограниченной.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        # В локали C/POSIX strxfrm — тождество: ключом служит само имя
+        self.identity = all(locale.strxfrm(s) == s for s in ('a', 'B', '_', 'ё'))
+        self._new = {}
+        self._old = {}
+
+    def key(self, name):
+        if self.identity:
+            return name
+        key = self._new.get(name)
+        if key is None:
+            key = self._old.get(name)
+            if key is None:
+                try:
+                    # Имя после '\0' различает строки с одинаковым strxfrm
+                    key = locale.strxfrm(name) + '\0' + name
+                except ValueError:
+                    key = name
+            self._new[name] = key
+            if len(self._new) > self.max_entries:
+                self._old = self._new
+                self._new = {}
+        return key
+
+
+COLLATION = CollationKeys(COLLATION_CACHE_ENTRIES)
+
+# Флаги записи каталога, вычисляются один раз при чтении директории
+F_DIR = 1   # директория (в том числе ссылка на директорию)
+F_LINK = 2  # символическая ссылка
+F_EXEC = 4  # исполняемый файл
+F_DELETED = 0x80  # строка FileTable удалена (ожидает уплотнения)
+
+# Режимы сортировки (клавиша 's' переключает их по кругу) и их подписи в заголовке
+SORT_MODES = ('name', 'natural', 'ext', 'size', 'mtime', 'dirs')
+SORT_TITLES = {
+    'name': "имя",
+    'natural': "естественный",
+    'ext': "расширение",
+    'size': "размер",
+    'mtime': "время изменения",
+    'dirs': "сначала директории",
+}
+
+_DIGITS_RE = re.compile(r'(\d+)')
+
+
+def natural_key(name):
+    """Ключ «естественного» порядка: file2 < file10, v1.9 < v1.10."""
+    parts = _DIGITS_RE.split(name.lower())
+    # Чётные элементы — строки, нечётные — числа, поэтому кортежи сравнимы
+    parts[1::2] = map(int, parts[1::2])
+    if not COLLATION.identity:
+        parts[0::2] = map(locale.strxfrm, parts[0::2])
+    return tuple(parts)
+
+
+def ext_key(name):
+    return sys.intern(os.path.splitext(name)[1].lower())
+
+
+# Ключи, которые вычисляются по имени и кэшируются в FileTable: режимы
+# сортировки и 'prefix' — имя без учёта регистра для поиска по префиксу
+NAME_KEY_FUNCS = {
+    'natural': natural_key,
+    'ext': ext_key,
+    'prefix': str.casefold,
+}
+# Символ больше любого другого: prefix + PREFIX_END ограничивает диапазон префикса
+PREFIX_END = '\U0010ffff'
+
+
+# Цветовые пары строк списка по типу записи (см. init_pair в FileManager)
+PAIR_DIR = 2
+PAIR_EXEC = 3
+PAIR_LINK = 4
+PAIR_FILE = 10
+
+
+def color_class(name, flags):
+    """Номер цветовой пары записи; вычисляется один раз при добавлении в FileTable."""
+    if flags & F_DIR or name == "..":
+        return PAIR_DIR
+    if flags & F_LINK:
+        return PAIR_LINK
+    if flags & F_EXEC:
+        return PAIR_EXEC
+    return PAIR_FILE
+
+
+def fit_width(text, width):
+    """
+    Обрезает text так, чтобы он занимал не больше width колонок терминала:
+    широкие (CJK) символы считаются за две колонки, комбинируемые — за ноль,
+    непечатаемые заменяются на '?', чтобы не ломать строку экрана.
+    """
+    if text.isascii() and text.isprintable():
+        return text[:width]
+    out = []
+    used = 0
+    for ch in text:
+        if not ch.isprintable():
+            ch = '?'
+        if unicodedata.combining(ch):
+            cols = 0
+        elif unicodedata.east_asian_width(ch) in 'WF':
+            cols = 2
+        else:
+            cols = 1
+        if used + cols > width:
+            break
+        out.append(ch)
+        used += cols
+    return ''.join(out)
+
+
+def _stat_record(st, is_dir):
+    """(flags, size, mtime_ns, mode) по результату lstat."""
+    mode = st.st_mode
+    flags = 0
+    if stat.S_ISLNK(mode):
+        flags |= F_LINK
+    if is_dir:
+        flags |= F_DIR
+    elif not flags & F_LINK and mode & 0o111:
+        flags |= F_EXEC
+    return flags, st.st_size, st.st_mtime_ns, mode
+
+
+class FsCallCounter:
+    """
+    Счётчик обращений к ФС (stat/lstat/scandir) при чтении листингов и их
+    обновлении; считает, только пока включена отладочная панель ('D').
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, n=1):
+        if self.enabled:
+            # Листинги читаются и в фоновых потоках
+            with self._lock:
+                self.count += n
+
+
+FS_CALLS = FsCallCounter()
+
+
+def fs_stat(path):
+    """os.stat с учётом в FS_CALLS."""
+    FS_CALLS.add()
+    return os.stat(path)
+
+
+def scan_entry(entry):
+    """Читает флаги и метаданные записи os.scandir, чтобы draw не обращался к ФС."""
+    # lstat записи, и для ссылки ещё stat цели в is_dir
+    FS_CALLS.add(2 if entry.is_symlink() else 1)
+    try:
+        return _stat_record(entry.stat(follow_symlinks=False), entry.is_dir())
+    except OSError:
+        return 0, 0, 0, 0
+
+
+def stat_entry(path):
+    """То же, что scan_entry, но для отдельного пути (lstat + stat для ссылок)."""
+    st = os.lstat(path)
+    FS_CALLS.add(2 if stat.S_ISLNK(st.st_mode) else 1)
+    is_dir = stat.S_ISDIR(st.st_mode) or (stat.S_ISLNK(st.st_mode) and os.path.isdir(path))
+    return _stat_record(st, is_dir)
+
+
+class InotifyWatcher:
+    """Наблюдение за одной директорией через inotify (Linux, вызовы libc через ctypes)."""
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+                  | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+    # struct inotify_event: int wd; uint32 mask, cookie, len; char name[len]
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        # Символы libc уже загружены в процесс интерпретатора
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.fd = fd
+        self.wd = None
+        self.path = None
+
+    @classmethod
+    def create(cls):
+        """Возвращает наблюдателя или None, если inotify недоступен."""
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            return cls()
+        except (OSError, AttributeError):
+            return None
+
+    def watch(self, path):
+        """Переключает наблюдение на path (старое наблюдение снимается)."""
+        if path == self.path and self.wd is not None:
+            return
+        if self.wd is not None:
+            self._libc.inotify_rm_watch(self.fd, self.wd)
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.WATCH_MASK)
+        self.wd = wd if wd >= 0 else None
+        self.path = path
+
+    def unwatch(self):
+        """
+        Снимает наблюдение. Нужно, когда по тому же пути теперь другая
+        директория (старую переместили или удалили): watch(path) иначе
+        оставил бы наблюдение на старом inode.
+        """
+        if self.wd is not None:
+            # После IN_IGNORED наблюдения уже нет, и ядро ответит EINVAL — это не ошибка
+            self._libc.inotify_rm_watch(self.fd, self.wd)
+        self.wd = None
+        self.path = None
+
+    def read_events(self):
+        """Возвращает список (mask, name) накопившихся событий текущей директории."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except (BlockingIOError, InterruptedError):
+                break
+            if not data:
+                break
+            pos = 0
+            while pos + self.EVENT.size <= len(data):
+                wd, mask, _cookie, length = self.EVENT.unpack_from(data, pos)
+                pos += self.EVENT.size
+                name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+                pos += length
+                # События снятых наблюдений пропускаем, переполнение очереди (wd == -1) — нет
+                if wd == self.wd or mask & self.IN_Q_OVERFLOW:
+                    events.append((mask, name))
+        return events
+
+    def close(self):
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+
+class FileRow:
+    """Представление одной строки FileTable (без копирования полей)."""
+
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    @property
+    def name(self):
+        return self.table.names[self.row]
+
+    @property
+    def flags(self):
+        return self.table.flags[self.row]
+
+    @property
+    def size(self):
+        return self.table.sizes[self.row]
+
+    @property
+    def mtime_ns(self):
+        return self.table.mtimes[self.row]
+
+    @property
+    def mode(self):
+        return self.table.modes[self.row]
+
+
+class FileTable:
+    """
+    Листинг директории в виде «структуры массивов»: имена в списке,
+    числовые поля в компактных array. Строки только добавляются, удалённые
+    помечаются F_DELETED и выбрасываются при compact(), поэтому номер
+    строки стабилен и на него могут ссылаться представления (FileView).
+
+    Память на 1M записей (CPython 3.11, 64 бит, имена ~17 символов):
+      names          ~74 МБ (8 Б ссылка + объект str)
+      flags  'B'       1 МБ
+      colors 'B'       1 МБ
+      sizes  'q'       8 МБ
+      mtimes 'q'       8 МБ (наносекунды)
+      modes  'I'       4 МБ
+      order  'i'       4 МБ (+4 МБ на каждое представление)
+    Итого ~100 МБ; те же поля в объектах со __slots__ добавляют к именам
+    ~185 МБ, в словарях — ~265 МБ. В локали, отличной от C, к этому
+    добавляются ключи strxfrm (collate), обычно в 2–4 раза длиннее имён.
+    """
+
+    def __init__(self):
+        self.names = []
+        # Цветовая пара каждой строки (color_class)
+        self.colors = array('B')
+        # Имена, обрезанные под ширину display_width: row -> строка; заполняется при отрисовке
+        self.display_width = 0
+        self._display = {}
+        # Ключи сопоставления по локали, выровненные по строкам; задают порядок имён
+        self.collate = []
+        self.flags = array('B')
+        self.sizes = array('q')
+        self.mtimes = array('q')
+        self.modes = array('I')
+        # Номера живых строк, отсортированные по ключу сопоставления имени
+        self.order = array('i')
+        self.dead = 0
+        # Кэш ключей сортировки по режимам: mode -> список, выровненный по строкам
+        self._keys = {}
+        # Кэш готовых порядков: mode -> (version, rows); version растёт при любом изменении
+        self._sorted = {}
+        self.version = 0
+
+    def __len__(self):
+        return len(self.order)
+
+    def row(self, row):
+        return FileRow(self, row)
+
+    def append(self, name, record, key=None):
+        """Добавляет строку (не трогая order); возвращает её номер."""
+        flags, size, mtime_ns, mode = record
+        self.version += 1
+        self.names.append(name)
+        self.colors.append(color_class(name, flags))
+        self.collate.append(key if key is not None else COLLATION.key(name))
+        self.flags.append(flags)
+        self.sizes.append(size)
+        self.mtimes.append(mtime_ns)
+        self.modes.append(mode)
+        return len(self.names) - 1
+
+    def update(self, row, record):
+        self.version += 1
+        self.flags[row], self.sizes[row], self.mtimes[row], self.modes[row] = record
+        self.colors[row] = color_class(self.names[row], record[0])
+
+    def display(self, row, width):
+        """Имя строки, обрезанное под width колонок; считается один раз на ширину."""
+        if width != self.display_width:
+            self.display_width = width
+            self._display = {}
+        text = self._display.get(row)
+        if text is None:
+            text = self._display[row] = fit_width(self.names[row], width)
+        return text
+
+    def find(self, name):
+        """Номер живой строки с именем name или -1 (bisect по order)."""
+        pos = FileView(self, self.order).find(name)
+        return self.order[pos] if pos >= 0 else -1
+
+    def insert(self, name, record):
+        """Добавляет строку и вставляет её в order; возвращает номер строки."""
+        row = self.append(name, record)
+        FileView(self, self.order).add_row(row)
+        return row
+
+    def remove(self, name):
+        """Удаляет строку из order и помечает её удалённой; возвращает номер или -1."""
+        view = FileView(self, self.order)
+        pos = view.find(name)
+        if pos < 0:
+            return -1
+        row = self.order[pos]
+        del self.order[pos]
+        self.version += 1
+        # Остальные поля не трогаем: по ним строку ещё находят в представлениях
+        self.flags[row] |= F_DELETED
+        self.dead += 1
+        return row
+
+    def _cached_keys(self, mode):
+        """Ключи режима mode для всех строк; досчитываются только для новых строк."""
+        keys = self._keys.setdefault(mode, [])
+        if len(keys) < len(self.names):
+            func = NAME_KEY_FUNCS[mode]
+            keys.extend(func(name) for name in self.names[len(keys):])
+        return keys
+
+    def _sort_func(self, mode):
+        """(key, reverse) для устойчивой сортировки поверх порядка имён."""
+        if mode == 'size':
+            return self.sizes.__getitem__, True
+        if mode == 'mtime':
+            return self.mtimes.__getitem__, True
+        if mode == 'dirs':
+            flags = self.flags
+            return (lambda row: not flags[row] & F_DIR), False
+        return self._cached_keys(mode).__getitem__, False
+
+    def sort_key(self, mode, row):
+        """Полный ключ строки в режиме mode (для bisect); совпадает с порядком sorted_rows."""
+        coll = self.collate[row]
+        if mode == 'name':
+            return coll
+        if mode == 'size':
+            return -self.sizes[row], coll
+        if mode == 'mtime':
+            return -self.mtimes[row], coll
+        if mode == 'dirs':
+            return not self.flags[row] & F_DIR, coll
+        return self._cached_keys(mode)[row], coll
+
+    def sorted_rows(self, mode):
+        """
+        Живые строки в порядке режима mode. Сортировка устойчивая и идёт
+        поверх order, поэтому при равных ключах файлы остаются по имени.
+        """
+        if mode == 'name':
+            return self.order
+        # Копия: представления меняют свой массив на месте
+        return array('i', self._sorted_order(mode))
+
+    def _sorted_order(self, mode):
+        """Закэшированный до следующего изменения таблицы порядок строк режима mode."""
+        cached = self._sorted.get(mode)
+        if cached is None or cached[0] != self.version:
+            key, reverse = self._sort_func(mode)
+            cached = (self.version, array('i', sorted(self.order, key=key, reverse=reverse)))
+            self._sorted[mode] = cached
+        return cached[1]
+
+    def prefix_index(self):
+        """
+        Представление живых строк по имени без учёта регистра для поиска
+        по префиксу (каждый поиск — bisect за O(log n)). Сортировка — одна
+        на таблицу: дальше FileManager поддерживает представление сам,
+        как и остальные (_attach_row/_detach_row).
+        """
+        return FileView(self, self.sorted_rows('prefix'), 'prefix')
+
+    def merge(self, rows):
+        """Подмешивает в order новые строки (list.sort сливает два отсортированных отрезка за O(n))."""
+        rows = sorted(rows, key=self.collate.__getitem__)
+        merged = self.order.tolist() + rows
+        merged.sort(key=self.collate.__getitem__)
+        self.order[:] = array('i', merged)
+        self.version += 1
+
+    def compact(self):
+        """Возвращает таблицу без удалённых строк; строки идут в порядке имён."""
+        if not self.dead:
+            return self
+        table = FileTable()
+        for row in self.order:
+            table.append(self.names[row], (self.flags[row], self.sizes[row],
+                                           self.mtimes[row], self.modes[row]),
+                         self.collate[row])
+        table.order = array('i', range(len(table.names)))
+        for mode, keys in self._keys.items():
+            if len(keys) == len(self.names):
+                table._keys[mode] = [keys[row] for row in self.order]
+        return table
+
+    def memory_bytes(self):
+        """Оценка занимаемой памяти для ListingCache."""
+        names = sys.getsizeof(self.names) + sum(sys.getsizeof(n) for n in self.names)
+        names += sys.getsizeof(self.collate)
+        if not COLLATION.identity:
+            names += sum(sys.getsizeof(k) for k in self.collate)
+        arrays = [self.flags, self.colors, self.sizes, self.mtimes, self.modes, self.order]
+        # Ключи режимов сортировки и готовые порядки хранятся вместе с таблицей
+        keys = 0
+        for mode, cached in self._keys.items():
+            keys += sys.getsizeof(cached)
+            if mode == 'ext':
+                # Расширения интернированы: одна строка на всех
+                keys += sum(sys.getsizeof(k) for k in set(cached))
+            elif mode == 'natural':
+                keys += sum(sys.getsizeof(k) + sum(map(sys.getsizeof, k)) for k in cached)
+            else:
+                keys += sum(map(sys.getsizeof, cached))
+        arrays.extend(rows for _version, rows in self._sorted.values())
+        return names + keys + sum(a.itemsize * len(a) for a in arrays)
+
+
+class _ViewKeys:
+    """Последовательность ключей сортировки строк представления (для bisect)."""
+
+    __slots__ = ('view',)
+
+    def __init__(self, view):
+        self.view = view
+
+    def __len__(self):
+        return len(self.view.rows)
+
+    def __getitem__(self, i):
+        view = self.view
+        return view.table.sort_key(view.mode, view.rows[i])
+
+
+class TypeAhead:
+    """
+    Инкрементальный поиск по префиксу имени (без учёта регистра). Каждый
+    новый символ сужает диапазон совпадений двумя bisect внутри прежнего
+    диапазона, Backspace возвращает сохранённый предыдущий диапазон.
+    """
+
+    def __init__(self, index):
+        # FileView в режиме 'prefix' (FileTable.prefix_index)
+        self.index = index
+        self.prefix = ''
+        # Стек диапазонов [lo, hi) индекса: по одному на каждый набранный префикс
+        self.ranges = [(0, len(self.index))]
+
+    def push(self, char):
+        self.prefix += char
+        lo, hi = self.ranges[-1]
+        key = self.prefix.casefold()
+        keys = _ViewKeys(self.index)
+        # Ключи индекса — кортежи (имя без регистра, ключ сопоставления)
+        lo = bisect.bisect_left(keys, (key,), lo, hi)
+        hi = bisect.bisect_left(keys, (key + PREFIX_END,), lo, hi)
+        self.ranges.append((lo, hi))
+
+    def pop(self):
+        if len(self.ranges) > 1:
+            self.prefix = self.prefix[:-1]
+            self.ranges.pop()
+
+    def match_row(self):
+        """Строка таблицы первого совпадения или -1."""
+        lo, hi = self.ranges[-1]
+        return self.index.rows[lo] if lo < hi else -1
+
+
+def fuzzy_pattern(query):
+    """Регулярное выражение «символы query по порядку, с любыми промежутками»."""
+    return re.compile('.*?'.join(map(re.escape, query)), re.IGNORECASE | re.DOTALL)
+
+
+class FilterJob(threading.Thread):
+    """Фоновая нечёткая фильтрация строк порциями для потоковой отрисовки."""
+
+    def __init__(self, names, rows, query):
+        super().__init__(daemon=True)
+        self.names = names
+        self.rows = rows
+        self.query = query
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = []  # совпавшие строки, ещё не забранные главным потоком
+        self._cancelled = False
+
+    def run(self):
+        search = fuzzy_pattern(self.query).search
+        names = self.names
+        try:
+            for start in range(0, len(self.rows), FILTER_CHUNK):
+                if self._cancelled:
+                    return
+                matched = [row for row in self.rows[start:start + FILTER_CHUNK]
+                           if search(names[row])]
+                with self._lock:
+                    self._pending.extend(matched)
+        finally:
+            self.done.set()
+
+    def take(self):
+        """Забирает накопленные совпадения."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        return batch
+
+    def cancel(self):
+        self._cancelled = True
+
+
+class FilterLevel:
+    """Результат фильтра для одного значения запроса."""
+
+    __slots__ = ('query', 'rows', 'done', 'job')
+
+    def __init__(self, query, rows=None, done=False):
+        self.query = query
+        self.rows = rows if rows is not None else array('i')
+        self.done = done
+        self.job = None
+
+
+class FuzzyFilter:
+    """
+    Инкрементальный нечёткий фильтр над представлением. На каждый набранный
+    символ — свой уровень: новый символ фильтрует только совпадения
+    предыдущего уровня, Backspace возвращается к сохранённому уровню.
+    Большие наборы кандидатов фильтруются в FilterJob, совпадения
+    подбираются poll() по мере готовности; порядок представления сохраняется.
+    """
+
+    def __init__(self, view):
+        self.view = view
+        self.levels = [FilterLevel('', view.rows, done=True)]
+
+    @property
+    def query(self):
+        return self.levels[-1].query
+
+    @property
+    def running(self):
+        return self.levels[-1].job is not None
+
+    def push(self, char):
+        self.cancel()
+        self.levels.append(FilterLevel(self.query + char))
+        self._start()
+
+    def pop(self):
+        if len(self.levels) == 1:
+            return
+        self.cancel()
+        self.levels.pop()
+        if not self.levels[-1].done:
+            self._start()
+
+    def cancel(self):
+        """Останавливает фильтрацию верхнего уровня (он остаётся незавершённым)."""
+        top = self.levels[-1]
+        if top.job is not None:
+            top.job.cancel()
+            top.job = None
+
+    def _start(self):
+        top = self.levels[-1]
+        # Кандидаты — ближайший полностью отфильтрованный уровень
+        source = next(level for level in reversed(self.levels) if level.done)
+        names = self.view.table.names
+        if len(source.rows) <= FILTER_SYNC_LIMIT:
+            search = fuzzy_pattern(top.query).search
+            top.rows = array('i', (row for row in source.rows if search(names[row])))
+            top.done = True
+        else:
+            top.rows = array('i')
+            top.job = FilterJob(names, source.rows, top.query)
+            top.job.start()
+
+    def poll(self):
+        """Забирает готовые совпадения; True, если результат изменился."""
+        top = self.levels[-1]
+        job = top.job
+        if job is None:
+            return False
+        finished = job.done.is_set()
+        batch = job.take()
+        top.rows.extend(batch)
+        if finished:
+            top.job = None
+            top.done = True
+        return bool(batch) or finished
+
+    def result(self):
+        """Представление текущих совпадений."""
+        return FileView(self.view.table, self.levels[-1].rows, self.view.mode)
+
+
+class FileView:
+    """
+    Упорядоченное подмножество строк FileTable (массив номеров строк),
+    отсортированное в режиме mode. Индексируется как список имён.
+    """
+
+    __slots__ = ('table', 'rows', 'mode')
+
+    def __init__(self, table, rows=None, mode='name'):
+        self.table = table
+        self.rows = rows if rows is not None else array('i')
+        self.mode = mode
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        return self.table.names[self.rows[i]]
+
+    def __iter__(self):
+        names = self.table.names
+        return (names[row] for row in self.rows)
+
+    def row(self, i):
+        return FileRow(self.table, self.rows[i])
+
+    def position(self, row):
+        """Позиция, на которой строка row стоит (или стояла бы) в представлении."""
+        return bisect.bisect_left(_ViewKeys(self), self.table.sort_key(self.mode, row))
+
+    def find_row(self, row):
+        """Возвращает позицию строки row или -1."""
+        pos = self.position(row)
+        if pos < len(self.rows) and self.rows[pos] == row:
+            return pos
+        return -1
+
+    def find(self, name):
+        """Возвращает позицию name или -1."""
+        if self.mode == 'name':
+            pos = bisect.bisect_left(_ViewKeys(self), COLLATION.key(name))
+            if pos < len(self.rows) and self[pos] == name:
+                return pos
+            return -1
+        row = self.table.find(name)
+        return self.find_row(row) if row >= 0 else -1
+
+    def add_row(self, row):
+        """Вставляет строку на своё место; возвращает позицию."""
+        pos = self.position(row)
+        self.rows.insert(pos, row)
+        return pos
+
+    def discard_row(self, row):
+        """Удаляет строку row; возвращает её бывшую позицию или -1."""
+        pos = self.find_row(row)
+        if pos >= 0:
+            del self.rows[pos]
+        return pos
+
+
+class DirectoryLoader(threading.Thread):
+    """Фоновое перечисление директории порциями для потоковой отрисовки."""
+
+    def __init__(self, path):
+        super().__init__(daemon=True)
+        self.path = path
+        self.count = 0
+        self.error = None
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = []  # [(name, record, key)], ещё не забранные главным потоком
+        self._cancelled = False
+
+    def run(self):
+        # Первые порции маленькие, чтобы быстрее показать первый экран
+        batch_size = 256
+        batch = []
+        try:
+            FS_CALLS.add()
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    if self._cancelled:
+                        return
+                    name = entry.name
+                    # Ключ сопоставления считаем здесь, а не в главном потоке
+                    batch.append((name, scan_entry(entry), COLLATION.key(name)))
+                    if len(batch) >= batch_size:
+                        self._publish(batch)
+                        batch = []
+                        batch_size = min(batch_size * 2, STREAM_BATCH)
+            self._publish(batch)
+        except OSError as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+    def _publish(self, batch):
+        with self._lock:
+            self._pending.extend(batch)
+            self.count += len(batch)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def take(self):
+        """Забирает накопленные записи."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        return batch
+
+    def cancel(self):
+        self._cancelled = True
+
+
+def _lower_thread_priority():
+    """Понижает приоритет текущего потока (в Linux nice действует на отдельный поток)."""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PREFETCH_NICE)
+    except (AttributeError, OSError):
+        pass
+
+
+def prefetch_listing(path, known_mtime_ns, cancel):
+    """
+    Читает директорию в FileTable в фоновом потоке.
+    Возвращает (mtime_ns, table) или None, если листинг не изменился,
+    слишком велик или чтение отменено.
+    """
+    mtime_ns = fs_stat(path).st_mtime_ns
+    if mtime_ns == known_mtime_ns:
+        return None
+    table = FileTable()
+    rows = []
+    FS_CALLS.add()
+    with os.scandir(path) as it:
+        for entry in it:
+            if cancel.is_set() or len(rows) >= PREFETCH_MAX_ENTRIES:
+                return None
+            rows.append(table.append(entry.name, scan_entry(entry)))
+    table.merge(rows)
+    return mtime_ns, table
+
+
+class Prefetcher:
+    """Пул низкоприоритетных потоков для предварительного чтения директорий."""
+
+    def __init__(self, workers):
+        self._pool = ThreadPoolExecutor(max_workers=workers,
+                                        thread_name_prefix="gfd-prefetch",
+                                        initializer=_lower_thread_priority)
+        # path -> (future, cancel_event)
+        self._jobs = {}
+
+    def __bool__(self):
+        return bool(self._jobs)
+
+    def submit(self, path, known_mtime_ns):
+        if path in self._jobs:
+            return
+        cancel = threading.Event()
+        future = self._pool.submit(prefetch_listing, path, known_mtime_ns, cancel)
+        self._jobs[path] = (future, cancel)
+
+    def cancel_all(self):
+        for future, cancel in self._jobs.values():
+            cancel.set()
+            future.cancel()
+        self._jobs.clear()
+
+    def collect(self):
+        """Возвращает [(path, mtime_ns, table)] завершённых заданий."""
+        results = []
+        for path, (future, _cancel) in list(self._jobs.items()):
+            if not future.done():
+                continue
+            del self._jobs[path]
+            try:
+                result = future.result()
+            except OSError:
+                continue
+            if result is not None:
+                results.append((path,) + result)
+        return results
+
+    def shutdown(self):
+        self.cancel_all()
+        self._pool.shutdown(wait=False)
+
+
+def format_size(size):
+    """Размер в байтах в виде «12.3 МБ»."""
+    for unit in ("Б", "КБ", "МБ", "ГБ"):
+        if size < 1024 or unit == "ГБ":
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def tree_size(path):
+    """Суммарный размер обычных файлов под path; ссылки внутри дерева не раскрываются."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0
+    if not stat.S_ISDIR(st.st_mode):
+        return st.st_size if stat.S_ISREG(st.st_mode) else 0
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            total += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+    return total
+
+
+# ioctl клонирования файла (reflink) на Btrfs/XFS: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+# errno, означающие «способ не поддерживается для этой пары ФС», а не сбой копирования
+COPY_FALLBACK_ERRNOS = {
+    getattr(errno, name) for name in
+    ('EXDEV', 'EOPNOTSUPP', 'ENOTSUP', 'ENOTTY', 'EINVAL', 'ENOSYS', 'EBADF', 'EPERM')
+    if hasattr(errno, name)
+}
+
+
+def _kernel_copy(call, fdin, fdout, progress):
+    """
+    Копирует порциями через call(fdin, fdout, n) до конца файла. Возвращает
+    False, если способ не подошёл до первого скопированного байта
+    (тогда позиции файлов не сдвинуты и можно пробовать следующий).
+    """
+    copied = 0
+    while True:
+        try:
+            n = call(fdin, fdout, KERNEL_COPY_CHUNK)
+        except OSError as e:
+            if copied == 0 and e.errno in COPY_FALLBACK_ERRNOS:
+                return False
+            raise
+        if n == 0:
+            # Файлы sysfs отдают 0 при ненулевом размере: нужен обычный read
+            return copied > 0
+        copied += n
+        progress(n)
+
+
+def copy_data(fsrc, fdst, progress, unsupported):
+    """
+    Копирует содержимое файла fsrc в пустой файл fdst (оба открыты без
+    буферизации, buffering=0) самым дешёвым
+    доступным способом: клонирование FICLONE (reflink, мгновенно на
+    Btrfs/XFS) → os.copy_file_range (данные не покидают ядро) →
+    os.sendfile → цикл read/write с буфером COPY_CHUNK. progress(n)
+    вызывается после каждой порции. unsupported — множество
+    (способ, устройство источника, устройство назначения), уже
+    отказавших в этой операции: их не пробуем повторно.
+    Возвращает название использованного способа.
+    """
+    fdin = fsrc.fileno()
+    fdout = fdst.fileno()
+    st = os.fstat(fdin)
+    devs = (st.st_dev, os.fstat(fdout).st_dev)
+    # Пустые файлы (и файлы procfs с нулевым размером) копируем обычным чтением
+    fast = st.st_size > 0
+    if fast and fcntl is not None and ('reflink',) + devs not in unsupported:
+        try:
+            fcntl.ioctl(fdout, FICLONE, fdin)
+        except OSError as e:
+            if e.errno not in COPY_FALLBACK_ERRNOS:
+                raise
+            unsupported.add(('reflink',) + devs)
+        else:
+            progress(st.st_size)
+            return 'reflink'
+    kernel_calls = []
+    if fast and hasattr(os, 'copy_file_range'):
+        kernel_calls.append(('copy_file_range', os.copy_file_range))
+    if fast and hasattr(os, 'sendfile'):
+        kernel_calls.append(('sendfile', lambda fdin, fdout, n: os.sendfile(fdout, fdin, None, n)))
+    for name, call in kernel_calls:
+        if (name,) + devs in unsupported:
+            continue
+        if _kernel_copy(call, fdin, fdout, progress):
+            return name
+        unsupported.add((name,) + devs)
+    buf = bytearray(COPY_CHUNK)
+    view = memoryview(buf)
+    while True:
+        n = fsrc.readinto(buf)
+        if not n:
+            return 'read/write'
+        written = 0
+        while written < n:
+            written += fdst.write(view[written:n])
+        progress(n)
+
+
+class JobCancelled(Exception):
+    """Фоновая операция отменена пользователем."""
+
+
+def parallel_copytree(src, dst, copy_function, workers=COPY_WORKERS, symlinks=False,
+                      dirs_exist_ok=False, cancel=None):
+    """
+    shutil.copytree, копирующий файлы пулом из workers потоков; dirs_exist_ok
+    относится только к корню, cancel (threading.Event) прерывает обход.
+    """
+    errors = []
+    # (src, dst) созданных директорий: copystat им делаем в конце, от глубоких к корню
+    dirs = []
+    # workers <= 0 — то же, что 1: иначе очередь нулевой длины и первый acquire не вернётся
+    workers = max(1, workers)
+    slots = threading.BoundedSemaphore(workers * 4)
+
+    def copy_one(s, d):
+        try:
+            copy_function(s, d)
+        except shutil.Error as err:
+            errors.extend(err.args[0])
+        except Exception as why:
+            errors.append((s, d, str(why)))
+        finally:
+            slots.release()
+
+    os.makedirs(dst, exist_ok=dirs_exist_ok)
+    pool = None
+    if workers > 1:
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gfd-copy")
+    try:
+        stack = [(src, dst)]
+        while stack:
+            if cancel is not None and cancel.is_set():
+                raise JobCancelled("операция отменена")
+            src_dir, dst_dir = stack.pop()
+            dirs.append((src_dir, dst_dir))
+            try:
+                with os.scandir(src_dir) as it:
+                    entries = list(it)
+            except OSError as why:
+                errors.append((src_dir, dst_dir, str(why)))
+                continue
+            subdirs = []
+            for entry in entries:
+                s = entry.path
+                d = os.path.join(dst_dir, entry.name)
+                try:
+                    if symlinks and entry.is_symlink():
+                        os.symlink(os.readlink(s), d)
+                        shutil.copystat(s, d, follow_symlinks=False)
+                    elif entry.is_dir():
+                        os.mkdir(d)
+                        subdirs.append((s, d))
+                    else:
+                        slots.acquire()
+                        if cancel is not None and cancel.is_set():
+                            slots.release()
+                            raise JobCancelled("операция отменена")
+                        if pool is None:
+                            copy_one(s, d)
+                        else:
+                            pool.submit(copy_one, s, d)
+                except OSError as why:
+                    errors.append((s, d, str(why)))
+            # Обратный порядок: директории обходятся в порядке scandir
+            stack.extend(reversed(subdirs))
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True)
+    for src_dir, dst_dir in reversed(dirs):
+        try:
+            shutil.copystat(src_dir, dst_dir)
+        except OSError as why:
+            errors.append((src_dir, dst_dir, str(why)))
+    if errors:
+        raise shutil.Error(errors)
+    return dst
+
+
+def verify_copy(src, dst):
+    """
+    Сверяет копию dst с оригиналом src по составу дерева, типам записей,
+    размерам файлов и целям ссылок. Возвращает список расхождений.
+    """
+    problems = []
+    stack = [(src, dst)]
+    while stack:
+        s, d = stack.pop()
+        try:
+            s_st = os.lstat(s)
+            d_st = os.lstat(d)
+        except OSError as e:
+            problems.append(f"{d}: {e.strerror}")
+            continue
+        if stat.S_IFMT(s_st.st_mode) != stat.S_IFMT(d_st.st_mode):
+            problems.append(f"{d}: другой тип записи")
+        elif stat.S_ISREG(s_st.st_mode) and s_st.st_size != d_st.st_size:
+            problems.append(f"{d}: размер {d_st.st_size} вместо {s_st.st_size}")
+        elif stat.S_ISLNK(s_st.st_mode) and os.readlink(s) != os.readlink(d):
+            problems.append(f"{d}: другая цель ссылки")
+        elif stat.S_ISDIR(s_st.st_mode):
+            copied = set(os.listdir(d))
+            for name in os.listdir(s):
+                if name in copied:
+                    stack.append((os.path.join(s, name), os.path.join(d, name)))
+                else:
+                    problems.append(f"{os.path.join(d, name)}: нет в копии")
+    return problems
+
+
+class PasteJob:
+    """Фоновое копирование или перемещение пар (src, dest) в dest_dir с прогрессом и отменой."""
+
+    def __init__(self, action, items, dest_dir):
+        self.action = action
+        self.items = items
+        self.dest_dir = dest_dir
+        self.added = []
+        # (директория, имя) перемещённых исходников
+        self.removed = []
+        self.errors = []
+        self.future = None
+        self.total = None  # None, пока идёт подсчёт размера
+        self.done = 0
+        self.current = ""
+        self.started = None
+        self._lock = threading.Lock()
+        # Способ копирования -> число файлов; отказавшие способы (см. copy_data)
+        self.strategies = {}
+        self.unsupported = set()
+        self.cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def _check_cancel(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled("операция отменена")
+
+    def run(self):
+        self.started = time.monotonic()
+        if self.cancelled:
+            # Отменена, не дождавшись свободного потока
+            return
+        # Перемещаемая ссылка переносится как ссылка, без содержимого цели
+        sizes = [0 if self.action == 'move' and os.path.islink(src) else tree_size(src)
+                 for src, _dest in self.items]
+        self.total = sum(sizes)
+        finished = 0
+        for (src, dest), size in zip(self.items, sizes):
+            if self.cancelled:
+                break
+            self.current = os.path.basename(src.rstrip(os.sep))
+            created = False
+            try:
+                if self.action == 'move':
+                    self.move_across(src, dest)
+                elif os.path.isdir(src):
+                    os.mkdir(dest)
+                    created = True
+                    parallel_copytree(src, dest, self.copy_file, dirs_exist_ok=True,
+                                      cancel=self.cancel_event)
+                else:
+                    # Файлы: copy_file копирует порциями и переносит метаданные, как copy2
+                    self.copy_file(src, dest)
+                self.added.append(os.path.basename(dest))
+                if self.action == 'move':
+                    self.removed.append(os.path.split(os.path.abspath(src.rstrip(os.sep))))
+            except Exception as e:
+                if self.cancelled:
+                    # Отменённую копию дерева не оставляем наполовину
+                    if created:
+                        shutil.rmtree(dest, ignore_errors=True)
+                    break
+                self.errors.append(f"{os.path.basename(src)}: {e}")
+            # Переименование и ошибки не копируют байты: выравниваем счётчик по элементу
+            finished += size
+            with self._lock:
+                self.done = finished
+
+    def move_across(self, src, dest):
+        """Перемещение между устройствами: копия, сверка, затем удаление источника."""
+        # dest создаём только эксклюзивно и при ошибке убираем лишь созданное нами
+        created = False
+        try:
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dest)
+                created = True
+            elif os.path.isdir(src):
+                os.mkdir(dest)
+                created = True
+                parallel_copytree(src, dest, self.copy_file, symlinks=True, dirs_exist_ok=True,
+                                  cancel=self.cancel_event)
+            else:
+                # Неполный файл copy_file при ошибке удаляет сам
+                self.copy_file(src, dest)
+                created = True
+            problems = verify_copy(src, dest)
+            if problems:
+                more = f" (и ещё {len(problems) - 1})" if len(problems) > 1 else ""
+                raise OSError(f"копия не совпадает с оригиналом: {problems[0]}{more}")
+        except BaseException:
+            if created:
+                if os.path.isdir(dest) and not os.path.islink(dest):
+                    shutil.rmtree(dest, ignore_errors=True)
+                else:
+                    os.unlink(dest)
+            raise
+        if os.path.isdir(src) and not os.path.islink(src):
+            shutil.rmtree(src)
+        else:
+            os.unlink(src)
+
+    def copy_file(self, src, dst):
+        """Аналог shutil.copy2 на copy_data: выбирает способ копирования и ведёт прогресс."""
+        if os.path.isdir(dst):
+            dst = os.path.join(dst, os.path.basename(src))
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            raise shutil.SameFileError(f"{src!r} and {dst!r} are the same file")
+        if stat.S_ISFIFO(os.stat(src).st_mode):
+            raise shutil.SpecialFileError(f"`{src}` is a named pipe")
+        self._check_cancel()
+        self.current = os.path.basename(src)
+        with open(src, 'rb', buffering=0) as fsrc:
+            # 'xb': файл, появившийся по этому пути после выбора имени, не затираем
+            fdst = open(dst, 'xb', buffering=0)
+            try:
+                with fdst:
+                    strategy = copy_data(fsrc, fdst, self._progress, self.unsupported)
+                shutil.copystat(src, dst)
+            except BaseException:
+                # Неполная копия создана нами: убираем её
+                os.unlink(dst)
+                raise
+        with self._lock:
+            self.strategies[strategy] = self.strategies.get(strategy, 0) + 1
+        return dst
+
+    def _progress(self, n):
+        with self._lock:
+            self.done += n
+        self._check_cancel()
+
+    def strategy_summary(self):
+        """Какими способами копировались файлы: «reflink ×3, copy_file_range ×1»."""
+        return ", ".join(f"{name} ×{count}" for name, count in
+                         sorted(self.strategies.items(), key=lambda item: -item[1]))
+
+    def status(self):
+        """Строка прогресса: объём, процент, скорость, оставшееся время, текущий файл."""
+        title = "Копирование" if self.action == 'copy' else "Перемещение"
+        if self.cancelled:
+            return f"{title}: отмена…"
+        if self.total is None:
+            return f"{title}: подсчёт размера…"
+        elapsed = max(time.monotonic() - self.started, 1e-3)
+        rate = self.done / elapsed
+        percent = self.done * 100 // self.total if self.total else 100
+        text = (f"{title} {format_size(self.done)} / {format_size(self.total)}"
+                f" ({percent}%), {format_size(rate)}/с")
+        if rate > 0 and self.total > self.done:
+            eta = int((self.total - self.done) / rate)
+            text += f", осталось {eta // 60}:{eta % 60:02d}"
+        if self.strategies:
+            text += f" [{max(self.strategies, key=self.strategies.get)}]"
+        return f"{text} — {self.current}"
+
+
+class JobEngine:
+    """Пул рабочих потоков для фоновых файловых операций (PasteJob)."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        # Пул создаётся при первой операции
+        self._pool = None
+        self.active = []
+
+    def __bool__(self):
+        return bool(self.active)
+
+    def __len__(self):
+        return len(self.active)
+
+    def submit(self, job):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers,
+                                            thread_name_prefix="gfd-job")
+        job.future = self._pool.submit(job.run)
+        self.active.append(job)
+
+    def reserved(self):
+        """Пути назначения незавершённых операций: их нельзя выдавать повторно."""
+        return {dest for job in self.active for _src, dest in job.items}
+
+    def collect(self):
+        """Возвращает завершённые операции и убирает их из активных."""
+        finished = [job for job in self.active if job.future.done()]
+        if finished:
+            self.active = [job for job in self.active if job not in finished]
+        for job in finished:
+            error = job.future.exception()
+            if error is not None:
+                job.errors.append(str(error))
+        return finished
+
+    def cancel_all(self):
+        """Отменяет все незавершённые операции (они откатывают текущий элемент)."""
+        for job in self.active:
+            job.cancel()
+
+    def shutdown(self):
+        """
+        Дожидается незавершённых операций: оборванная на полпути копия хуже
+        ожидания. Чтобы выйти быстро, сначала вызывается cancel_all.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+
+class ListingCache:
+    """LRU-кэш листингов директорий с ключом (путь, st_mtime_ns) и лимитом памяти."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        # path -> (mtime_ns, table, size)
+        self._items = OrderedDict()
+
+    def take(self, path, mtime_ns):
+        """
+        Забирает FileTable из кэша или возвращает None, если записи нет
+        или mtime изменился. Забранный листинг принадлежит вызывающему,
+        пока он не вернёт его через put.
+        """
+        item = self._items.pop(path, None)
+        if item is None:
+            return None
+        self.used_bytes -= item[2]
+        if item[0] != mtime_ns:
+            return None
+        return item[1]
+
+    def peek_mtime(self, path):
+        """mtime закэшированного листинга path или None."""
+        item = self._items.get(path)
+        return item[0] if item is not None else None
+
+    def put(self, path, mtime_ns, table):
+        self.discard(path)
+        if time.time_ns() - mtime_ns <= LISTING_CACHE_RACY_NS:
+            # mtime ещё не «устоялся»: следующее изменение может его не сдвинуть
+            return
+        table = table.compact()
+        size = table.memory_bytes()
+        if size > self.max_bytes:
+            return
+        self._items[path] = (mtime_ns, table, size)
+        self.used_bytes += size
+        # Вытесняем давно не использованные листинги
+        while self.used_bytes > self.max_bytes:
+            _, old = self._items.popitem(last=False)
+            self.used_bytes -= old[2]
+
+    def discard(self, path):
+        item = self._items.pop(path, None)
+        if item is not None:
+            self.used_bytes -= item[2]
+
+
+def percentile(data, p):
+    """p-й перцентиль отсортированного списка data (None для пустого)."""
+    if not data:
+        return None
+    return data[min(len(data) - 1, len(data) * p // 100)]
+
+
+class FrameStats:
+    """
+    Замеры фаз главного цикла (time.perf_counter_ns) в скользящих окнах
+    по FRAME_STATS_SAMPLES значений:
+      list  — get_files (чтение или взятие листинга из кэша);
+      input — обработка клавиши в handle_input (включает list и диалоги);
+      draw  — сборка кадра;
+      term  — вывод изменённых строк и doupdate.
+    Плюс число обращений к ФС за последний кадр (FS_CALLS).
+    Создаётся только при включённой панели: без неё замеры не делаются.
+    """
+
+    PHASES = ('list', 'input', 'draw', 'term')
+
+    def __init__(self):
+        self.samples = {phase: deque(maxlen=FRAME_STATS_SAMPLES) for phase in self.PHASES}
+        self.fs_calls = None
+        self._frame_start = time.perf_counter_ns()
+        self._fs_start = FS_CALLS.count
+
+    def add(self, phase, ns):
+        self.samples[phase].append(ns)
+
+    def frame_begin(self):
+        """Отмечает начало кадра: клавиша прочитана."""
+        self._fs_start = FS_CALLS.count
+        self._frame_start = time.perf_counter_ns()
+
+    def input_done(self):
+        self.add('input', time.perf_counter_ns() - self._frame_start)
+
+    def frame_end(self):
+        """Отмечает конец кадра: изменения отправлены в терминал."""
+        self.fs_calls = FS_CALLS.count - self._fs_start
+
+    def percentile(self, phase, p):
+        return percentile(sorted(self.samples[phase]), p)
+
+    def summary(self):
+        """Строка панели: p50/p99 каждой фазы в мс и обращения к ФС за кадр."""
+        parts = []
+        for phase in self.PHASES:
+            p50 = self.percentile(phase, 50)
+            if p50 is not None:
+                p99 = self.percentile(phase, 99)
+                parts.append(f"{phase} {p50 / 1e6:.2f}/{p99 / 1e6:.2f}")
+        text = " ".join(parts) + " мс p50/p99" if parts else "нет замеров"
+        if self.fs_calls is not None:
+            text += f" | stat/scandir: {self.fs_calls}"
+        return text
+
+
+class CursesScreen:
+    """
+    Экран на curses. Методы окна (addstr, move, get_wch, timeout, ...)
+    передаются stdscr как есть; функции модуля curses, которые нужны
+    FileManager, собраны здесь, чтобы их можно было подменить VirtualScreen.
+    """
+
     def __init__(self, stdscr):
         self.stdscr = stdscr
-        self.current_dir = os.getcwd()
-        self.last_dir = self.current_dir # Запоминаем начальную директорию
-        self.cursor_pos = 0
-        self.offset = 0
-        self.files = []
-        self.selected_files = set()
-        self.show_hidden = False
-        # Словарь для хранения позиций курсора по директориям
-        self.cursor_positions = {}
-        self.height, self.width = stdscr.getmaxyx()
-        self.max_items = self.height - 3  # Оставляем место для заголовка и строки статуса
+        self.last_key_time = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.stdscr, name)
+
+    def get_wch(self):
+        key = self.stdscr.get_wch()
+        self.last_key_time = time.monotonic()
+        return key
+
+    def key_time(self):
+        """Время (с) последней прочитанной клавиши: по нему считается автоповтор стрелок."""
+        return self.last_key_time
+
+    def settling(self):
+        """Дожидаться ли фоновой работы на тайм-ауте ввода (только при воспроизведении)."""
+        return False
+
+    def init_colors(self):
+        """Скрывает курсор и настраивает цвета и цветовые пары."""
         curses.curs_set(0)  # Скрываем курсор
         curses.start_color()
         curses.use_default_colors()
 
-    # Кастомные цвета
+        # Кастомные цвета
         curses.init_color(10, 400, 400, 600)  # пастельно-синий
         curses.init_color(11, 500, 500, 500)  # серый
         curses.init_color(12, 550, 500, 300)  # фисташковый
@@ -45,7 +1560,7 @@ class FileManager:
         curses.init_color(15, 950, 900, 700)    # курсор
         curses.init_color(16, 320, 320, 320) # <--- НОВЫЙ ЦВЕТ: для обычных файлов
     
-    # Пары цветов
+        # Пары цветов
         curses.init_pair(1, 15, -1)    # курсор
         curses.init_pair(2, 11, -1)  # директории
         curses.init_pair(3, 12, -1)  # фисташковый (для исполняемых)
@@ -56,6 +1571,451 @@ class FileManager:
         curses.init_pair(8, curses.COLOR_RED, -1)    # delete
         curses.init_pair(9, 14, -1)   # сообщения — мягкий серый
         curses.init_pair(10, 16, -1)  # <--- НОВАЯ ПАРА: для обычных файлов (использует цвет 16)
+
+    def curs_set(self, visibility):
+        return curses.curs_set(visibility)
+
+    def color_pair(self, pair):
+        return curses.color_pair(pair)
+
+    def doupdate(self):
+        curses.doupdate()
+
+    def napms(self, ms):
+        curses.napms(ms)
+
+    def noecho(self):
+        curses.noecho()
+
+    def suspend(self):
+        """Отдаёт терминал внешней программе (до следующего doupdate)."""
+        curses.endwin()
+
+    def popup(self, height, width, y, x):
+        # Окно больше экрана newwin не создаст (бывает после уменьшения терминала)
+        lines, columns = self.stdscr.getmaxyx()
+        return curses.newwin(min(height, lines - y), min(width, columns - x), y, x)
+
+
+class VirtualWindow:
+    """Прямоугольная область VirtualScreen с API окна curses."""
+
+    def __init__(self, screen, height, width, y, x):
+        self.screen = screen
+        self.height = height
+        self.width = width
+        self.y = y
+        self.x = x
+        self.background = 0
+        self.cy = self.cx = 0
+
+    def getmaxyx(self):
+        return self.height, self.width
+
+    def addstr(self, y, x, text, attr=0):
+        if not (0 <= y < self.height and 0 <= x < self.width):
+            raise curses.error('addstr() returned ERR')
+        screen = self.screen
+        screen.writes += 1
+        chars = screen.chars[self.y + y]
+        attrs = screen.attrs[self.y + y]
+        start = self.x + x
+        text = text[:self.width - x]
+        chars[start:start + len(text)] = text
+        attrs[start:start + len(text)] = [attr or self.background] * len(text)
+        self.cy, self.cx = y, x + len(text)
+
+    def addnstr(self, y, x, text, n, attr=0):
+        self.addstr(y, x, text[:n], attr)
+
+    def move(self, y, x):
+        if not (0 <= y < self.height and 0 <= x < self.width):
+            raise curses.error('wmove() returned ERR')
+        self.cy, self.cx = y, x
+
+    def clrtoeol(self):
+        row = self.y + self.cy
+        start = self.x + self.cx
+        end = self.x + self.width
+        self.screen.chars[row][start:end] = [' '] * (end - start)
+        self.screen.attrs[row][start:end] = [self.background] * (end - start)
+
+    def erase(self):
+        for y in range(self.height):
+            self.cy, self.cx = y, 0
+            self.clrtoeol()
+        self.cy = self.cx = 0
+
+    clear = erase
+
+    def border(self, *chars):
+        self.addstr(0, 0, '+' + '-' * (self.width - 2) + '+')
+        for y in range(1, self.height - 1):
+            self.addstr(y, 0, '|')
+            self.addstr(y, self.width - 1, '|')
+        self.screen.chars[self.y + self.height - 1][self.x:self.x + self.width] = \
+            '+' + '-' * (self.width - 2) + '+'
+
+    def bkgd(self, char, attr=0):
+        self.background = attr
+
+    def refresh(self):
+        self.screen.refreshes += 1
+
+    noutrefresh = refresh
+
+
+class VirtualScreen(VirtualWindow):
+    """
+    Экран в памяти для запуска FileManager без терминала (бенчмарки, тесты).
+    Хранит символы и атрибуты каждой ячейки, считает вызовы addstr,
+    refresh/noutrefresh и doupdate. Клавиши берутся из очереди keys:
+    None означает «клавиши нет» (тайм-аут ожидания). Пауз нет: napms
+    возвращается сразу.
+    """
+
+    def __init__(self, height=24, width=80, keys=()):
+        super().__init__(self, height, width, 0, 0)
+        self.chars = [[' '] * width for _ in range(height)]
+        self.attrs = [[0] * width for _ in range(height)]
+        self.keys = deque(keys)
+        self.delay = -1
+        self.last_key_time = 0.0
+        self.cursor_visible = 0
+        self.writes = 0
+        self.refreshes = 0
+        self.updates = 0
+
+    def resize(self, height, width):
+        """Меняет размер экрана и ставит в очередь KEY_RESIZE, как терминал."""
+        self.height, self.width = height, width
+        self.chars = [[' '] * width for _ in range(height)]
+        self.attrs = [[0] * width for _ in range(height)]
+        self.keys.appendleft(curses.KEY_RESIZE)
+
+    def line(self, y):
+        """Текст строки экрана без хвостовых пробелов."""
+        return ''.join(self.chars[y]).rstrip()
+
+    def text(self):
+        return '\n'.join(self.line(y) for y in range(self.height))
+
+    def init_colors(self):
+        pass
+
+    def timeout(self, delay):
+        self.delay = delay
+
+    def nodelay(self, flag):
+        self.delay = 0 if flag else -1
+
+    def get_wch(self):
+        key = self.keys.popleft() if self.keys else None
+        if key is None:
+            if self.delay < 0:
+                raise EOFError("VirtualScreen: очередь клавиш пуста")
+            raise curses.error('no input')
+        self.last_key_time = time.monotonic()
+        return key
+
+    def key_time(self):
+        return self.last_key_time
+
+    def settling(self):
+        return False
+
+    def curs_set(self, visibility):
+        previous, self.cursor_visible = self.cursor_visible, visibility
+        return previous
+
+    def color_pair(self, pair):
+        return pair << 8
+
+    def doupdate(self):
+        self.updates += 1
+
+    def napms(self, ms):
+        pass
+
+    def noecho(self):
+        pass
+
+    def suspend(self):
+        pass
+
+    def popup(self, height, width, y, x):
+        return VirtualWindow(self, min(height, self.height - y), min(width, self.width - x), y, x)
+
+
+# Имена спецклавиш для отчёта о задержках: 258 -> 'KEY_DOWN'
+KEY_NAMES = {code: name for name, code in vars(curses).items()
+             if name.startswith('KEY_') and isinstance(code, int)}
+
+
+def load_keys(path):
+    """
+    Читает запись нажатий (JSON Lines): список (секунды от начала, клавиша или
+    None для тайм-аута ожидания, взята ли из буфера), начало и итог сессии.
+    """
+    keys = []
+    start = end = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                if 'start' in record:
+                    start = record['start']
+                elif 'end' in record:
+                    end = record['end']
+                elif 'idle' in record:
+                    keys.append((record['t'], None, False))
+                else:
+                    key = record['key'] if 'key' in record else record['code']
+                    keys.append((record['t'], key, record.get('queued', False)))
+    return keys, start, end
+
+
+class RecordingScreen:
+    """Обёртка экрана, записывающая прочитанные клавиши и тайм-ауты ожидания в JSON Lines."""
+
+    def __init__(self, screen, path):
+        self.screen = screen
+        self.file = open(path, 'w', encoding='utf-8')
+        self.start = time.monotonic()
+        self.delay = -1
+        self.last_t = 0.0
+        self.idle = False
+
+    def __getattr__(self, name):
+        return getattr(self.screen, name)
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def begin(self, start):
+        """Пишет начало сессии: директорию, размер экрана и сохранённые позиции курсора."""
+        self._write({'start': start})
+
+    def timeout(self, delay):
+        self.delay = delay
+        self.screen.timeout(delay)
+
+    def nodelay(self, flag):
+        self.delay = 0 if flag else -1
+        self.screen.nodelay(flag)
+
+    def get_wch(self):
+        try:
+            key = self.screen.get_wch()
+        except curses.error:
+            # Тайм-аут ожидания при фоновой работе: подряд идущие пишем одной записью
+            if self.delay > 0 and not self.idle:
+                self.idle = True
+                self._write({'t': round(time.monotonic() - self.start, 4), 'idle': True})
+            raise
+        self.idle = False
+        self.last_t = round(time.monotonic() - self.start, 4)
+        record = {'t': self.last_t}
+        record['key' if isinstance(key, str) else 'code'] = key
+        if self.delay == 0:
+            record['queued'] = True
+        self._write(record)
+        return key
+
+    def key_time(self):
+        return self.last_t
+
+    def close(self, end=None):
+        if end is not None:
+            self._write({'end': end})
+        self.file.close()
+
+
+class ReplayScreen:
+    """Обёртка экрана, подающая записанные нажатия (realtime — с исходными паузами) и меряющая задержки."""
+
+    def __init__(self, screen, keys, realtime=False, live=True, expected=None):
+        self.screen = screen
+        self.keys = deque(keys)
+        self.realtime = realtime
+        self.live = live
+        self.expected = expected
+        self.result = None
+        self.delay = -1
+        self.start = None
+        self.last_t = None
+        # (клавиша, задержка в нс) для каждой воспроизведённой клавиши
+        self.latencies = []
+        self._last = None
+
+    def __getattr__(self, name):
+        return getattr(self.screen, name)
+
+    def timeout(self, delay):
+        self.delay = delay
+        self.screen.timeout(delay)
+
+    def nodelay(self, flag):
+        self.delay = 0 if flag else -1
+        self.screen.nodelay(flag)
+
+    def get_wch(self):
+        self.finish()
+        if not self.keys:
+            if self.live:
+                self.last_t = None
+                return self.screen.get_wch()
+            if self.delay == 0:
+                raise curses.error('no input')
+            raise EOFError("запись нажатий воспроизведена")
+        if self.start is None:
+            self.start = time.monotonic()
+        t, key, queued = self.keys[0]
+        if self.delay == 0 and not queued:
+            # При записи этой клавиши в буфере ещё не было
+            raise curses.error('no input')
+        if key is None:
+            self.keys.popleft()
+            if self.realtime or self.delay < 0:
+                # Паузы realtime воспроизводит сам; без фоновой работы ждать нечего
+                return self.get_wch()
+            raise curses.error('no input')
+        if self.realtime and not queued:
+            wait = self.start + t - time.monotonic()
+            if wait > 0:
+                # Клавиша ещё «не нажата»: ведём себя как ожидание с тайм-аутом
+                if self.delay >= 0 and wait > self.delay / 1000:
+                    time.sleep(self.delay / 1000)
+                    raise curses.error('no input')
+                time.sleep(wait)
+        self.keys.popleft()
+        self.last_t = t
+        self._last = (key, time.perf_counter_ns())
+        return key
+
+    def key_time(self):
+        # После конца записи время идёт от настоящего экрана
+        return self.screen.key_time() if self.last_t is None else self.last_t
+
+    def settling(self):
+        """
+        True, пока запись воспроизводится на максимальной скорости: тайм-аут
+        в ней означает паузу, за которую фоновая работа успела закончиться.
+        """
+        return not self.realtime and bool(self.keys)
+
+    def check(self, state):
+        """Запоминает состояние в конце воспроизведения; True, если оно совпало с записью."""
+        self.result = state
+        return self.matches()
+
+    def matches(self):
+        return self.expected is None or self.result == self.expected
+
+    def finish(self):
+        """Засчитывает задержку последней выданной клавиши."""
+        if self._last is not None:
+            key, delivered = self._last
+            self.latencies.append((key, time.perf_counter_ns() - delivered))
+            self._last = None
+
+    def report(self):
+        """Текстовый отчёт: задержки по всем клавишам и по каждой клавише отдельно."""
+        self.finish()
+        by_key = {}
+        for key, ns in self.latencies:
+            title = repr(key) if isinstance(key, str) else KEY_NAMES.get(key, str(key))
+            by_key.setdefault(title, []).append(ns)
+        total = sorted(ns for _, ns in self.latencies)
+        lines = [f"Клавиш: {len(total)}"]
+
+        def row(title, data):
+            data = sorted(data)
+            return (f"{title:>12}  n={len(data):<6} p50={percentile(data, 50) / 1e6:8.2f}"
+                    f"  p99={percentile(data, 99) / 1e6:8.2f}  max={data[-1] / 1e6:8.2f} мс")
+
+        if total:
+            lines.append(row("все", total))
+            # Сначала клавиши с самой медленной обработкой
+            for title, data in sorted(by_key.items(), key=lambda item: -max(item[1])):
+                lines.append(row(title, data))
+        if self.expected is not None and self.result is not None:
+            if self.matches():
+                lines.append(f"Итог совпадает с записью: {self.expected}")
+            else:
+                lines.append(f"Итог расходится с записью: записано {self.expected},"
+                             f" воспроизведено {self.result}")
+        return "\n".join(lines)
+
+
+class FileManager:
+    def __init__(self, screen, persist=True):
+        self.screen = screen
+        # False — не читать и не писать CURSOR_POSITIONS_FILE и CD_FILE (воспроизведение без терминала)
+        self.persist = persist
+        self.current_dir = os.getcwd()
+        self.last_dir = self.current_dir # Запоминаем начальную директорию
+        self.cursor_pos = 0
+        self.offset = 0
+        # Полный (со скрытыми) листинг текущей директории
+        self.table = FileTable()
+        # Представления таблицы: все строки и строки без скрытых файлов.
+        # Оба поддерживаются постоянно, поэтому '.' лишь переключает self.files
+        self.view_all = FileView(self.table, self.table.order)
+        self.view_visible = FileView(self.table)
+        # Отображаемое представление
+        self.files = self.view_visible
+        # Индекс для поиска по префиксу (FileTable.prefix_index): строится при
+        # первом поиске в листинге и дальше обновляется вместе с представлениями
+        self.view_prefix = None
+        # Директория и mtime, которым соответствует self.table
+        self.listing_dir = None
+        self.listing_mtime_ns = 0
+        # Фоновое чтение текущей директории (None, если листинг полный)
+        self.loader = None
+        # Имена, добавленные и удалённые событиями во время потокового чтения:
+        # их не подмешиваем из поздних порций
+        self.stream_added = set()
+        self.stream_removed = set()
+        # Сохранённая позиция курсора, ждущая конца потокового чтения:
+        # (сохранённая запись, позиция, куда курсор поставлен пока) или None
+        self.pending_cursor = None
+        self.needs_redraw = True
+        # Теневой буфер экрана: y -> (текст, атрибут) того, что сейчас нарисовано
+        self.screen_lines = {}
+        self.selected_files = set()
+        self.show_hidden = False
+        # Текущий режим сортировки (один из SORT_MODES)
+        self.sort_mode = 'name'
+        # Кэш полных (с учётом скрытых) листингов для быстрой навигации назад/вперёд
+        self.listing_cache = ListingCache(LISTING_CACHE_MB * 1024 * 1024)
+        # inotify-наблюдатель за текущей директорией (None вне Linux)
+        self.watcher = InotifyWatcher.create()
+        # Предварительное чтение директории под курсором
+        self.prefetcher = Prefetcher(PREFETCH_WORKERS)
+        self.prefetch_target = None
+        self.prefetch_due = 0.0
+        # Фоновые операции вставки и время последней перерисовки их прогресса
+        self.jobs = JobEngine(JOB_WORKERS)
+        self.progress_drawn = 0.0
+        # Активный поиск по префиксу (TypeAhead) или None
+        self.typeahead = None
+        # Активный нечёткий фильтр (FuzzyFilter) или None
+        self.fuzzy = None
+        # Замеры для отладочной панели (FrameStats) или None, если панель выключена
+        self.stats = None
+        # Клавиша, прочитанная при сборе стрелок из буфера и ещё не обработанная
+        self.pending_key = None
+        # Автоповтор стрелок: клавиша, число повторов подряд и время последнего
+        self.repeat_key = None
+        self.repeat_count = 0
+        self.repeat_time = 0.0
+        # Словарь для хранения позиций курсора по директориям
+        self.cursor_positions = {}
+        self.height, self.width = screen.getmaxyx()
+        self.max_items = self.height - 3  # Оставляем место для заголовка и строки статуса
+        screen.init_colors()
             
 
         # Буфер (clipboard) для copy/move
@@ -63,20 +2023,350 @@ class FileManager:
         self.clipboard = []  # список полных путей
         self.clipboard_action = None
 
-        self.load_cursor_positions()
+        if persist:
+            self.load_cursor_positions()
         self.get_files()
 
     def get_files(self):
-        self.files = []
+        started = time.perf_counter_ns()
+        self.store_listing()
+        self.collect_prefetched()
+        self.table = FileTable()
+        self._build_views()
         try:
-            if self.show_hidden:
-                self.files.extend(sorted(os.listdir(self.current_dir)))
-            else:
-                self.files.extend(sorted([f for f in os.listdir(self.current_dir) if not f.startswith('.')]))
+            # Наблюдение включаем до чтения, чтобы не пропустить изменения во время него
+            if self.watcher is not None:
+                self.watcher.watch(self.current_dir)
+            mtime_ns = fs_stat(self.current_dir).st_mtime_ns
+            table = self.listing_cache.take(self.current_dir, mtime_ns)
+            if table is None:
+                table = self.load_first_screen()
+            self.table = table
+            self.listing_dir = self.current_dir
+            self.listing_mtime_ns = mtime_ns
+            self._build_views()
         except PermissionError:
             self.show_message("Ошибка доступа к директории")
             self.current_dir = os.path.dirname(self.current_dir)
             self.get_files()
+        if self.stats is not None:
+            self.stats.add('list', time.perf_counter_ns() - started)
+
+    def load_first_screen(self):
+        """
+        Запускает DirectoryLoader и ждёт либо полного листинга (не дольше
+        STREAM_FIRST_WAIT), либо первого экрана записей. Остальное подмешивается
+        в poll_loader. Возвращает FileTable уже прочитанной части.
+        """
+        loader = DirectoryLoader(self.current_dir)
+        loader.start()
+        deadline = time.monotonic() + STREAM_FIRST_WAIT
+        while not loader.done.wait(0.005):
+            if loader.count >= self.max_items and time.monotonic() >= deadline:
+                self.loader = loader
+                self.stream_added = set()
+                self.stream_removed = set()
+                break
+        else:
+            if loader.error is not None:
+                raise loader.error
+        table = FileTable()
+        table.merge([table.append(*item) for item in loader.take()])
+        return table
+
+    def poll_loader(self):
+        """
+        Подмешивает порции фонового чтения в листинг.
+        Возвращает True, пока идёт чтение (в заголовке меняется счётчик).
+        """
+        loader = self.loader
+        if loader is None:
+            return False
+        finished = loader.done.is_set()
+        # Сливаем порции геометрически растущего размера: суммарно O(n log n)
+        if finished or loader.pending_count() >= max(self.max_items, len(self.table) // 4):
+            self._merge_loaded(loader.take())
+        if finished:
+            self.loader = None
+            self.pending_cursor = None
+            self.stream_added = set()
+            self.stream_removed = set()
+            if loader.error is not None:
+                self.show_message(f"Ошибка чтения директории: {loader.error}")
+        return True
+
+    def _merge_loaded(self, batch):
+        """Сливает порцию (name, record, key) с таблицей и отображаемым представлением."""
+        anchor = self._cursor_row() if self.cursor_pos > 0 else -1
+        skip = self.stream_added | self.stream_removed
+        new = [self.table.append(*item) for item in batch if item[0] not in skip]
+        if not new:
+            return
+        self.table.merge(new)
+        # Порция прошла мимо _attach_row: индекс префиксов построим заново при поиске
+        self.view_prefix = None
+        self._build_views()
+        pending = self.pending_cursor
+        if pending is not None and self.cursor_pos == pending[1]:
+            # Курсор ждёт сохранённую позицию и пользователь его не трогал.
+            # Поздние порции вставляются и перед ним, поэтому позиция
+            # окончательна только после последней (см. poll_loader)
+            saved = pending[0]
+            self.jump_to(saved['cursor_pos'], saved['offset'])
+            self.pending_cursor = (saved, self.cursor_pos)
+            return
+        self.pending_cursor = None
+        # Курсор, сдвинутый пользователем, остаётся на том же файле
+        if anchor >= 0:
+            self._move_cursor_to_row(anchor)
+
+    def store_listing(self):
+        """Возвращает листинг текущей директории в кэш."""
+        if self.loader is not None:
+            # Неполный листинг в кэш не кладём
+            self.loader.cancel()
+            self.loader = None
+            self.pending_cursor = None
+            self.listing_dir = None
+            return
+        if self.listing_dir is None:
+            return
+        self.listing_cache.put(self.listing_dir, self.listing_mtime_ns, self.table)
+        self.listing_dir = None
+
+    def schedule_prefetch(self):
+        """
+        Запоминает директорию под курсором; читать её начнём, если курсор
+        простоит на ней PREFETCH_DWELL. Смена цели отменяет начатые чтения.
+        """
+        target = None
+        if self.cursor_pos < len(self.files) and self.files.row(self.cursor_pos).flags & F_DIR:
+            target = os.path.join(self.current_dir, self.files[self.cursor_pos])
+        if target == self.prefetch_target:
+            return
+        self.prefetcher.cancel_all()
+        self.prefetch_target = target
+        self.prefetch_due = time.monotonic() + PREFETCH_DWELL
+
+    def poll_prefetch(self):
+        """Запускает созревшее предварительное чтение и забирает готовые листинги в кэш."""
+        if self.prefetch_target is not None and time.monotonic() >= self.prefetch_due:
+            path = self.prefetch_target
+            self.prefetch_target = None
+            self.prefetcher.submit(path, self.listing_cache.peek_mtime(path))
+        self.collect_prefetched()
+
+    def collect_prefetched(self):
+        for path, mtime_ns, table in self.prefetcher.collect():
+            self.listing_cache.put(path, mtime_ns, table)
+
+    def _build_views(self):
+        """Строит представления view_all и view_visible над self.table в режиме sort_mode."""
+        table = self.table
+        names = table.names
+        # В режиме 'name' view_all разделяет массив table.order
+        rows = table.sorted_rows(self.sort_mode)
+        self.view_all = FileView(table, rows, self.sort_mode)
+        self.view_visible = FileView(table, array(
+            'i', (row for row in rows if not names[row].startswith('.'))), self.sort_mode)
+        self.files = self.view_all if self.show_hidden else self.view_visible
+        # Индекс префиксов от режима сортировки не зависит: сбрасываем только с таблицей
+        if self.view_prefix is not None and self.view_prefix.table is not table:
+            self.view_prefix = None
+
+    def _cursor_row(self):
+        """Номер строки таблицы под курсором или -1."""
+        if self.cursor_pos < len(self.files):
+            return self.files.rows[self.cursor_pos]
+        return -1
+
+    def _move_cursor_to_row(self, row):
+        """Ставит курсор на строку row, а если её нет в представлении — на место, где она была бы."""
+        if row >= 0:
+            self.cursor_pos = self.files.position(row)
+        self.cursor_pos = max(0, min(self.cursor_pos, len(self.files) - 1))
+        self._scroll_to_cursor()
+
+    def toggle_hidden(self):
+        """Переключает показ скрытых файлов без обращения к ФС; курсор остаётся на том же имени."""
+        anchor = self._cursor_row()
+        self.show_hidden = not self.show_hidden
+        self.files = self.view_all if self.show_hidden else self.view_visible
+        # Если файл под курсором стал скрытым — встаём на ближайший следующий
+        self._move_cursor_to_row(anchor)
+
+    def cycle_sort_mode(self):
+        """Переключает режим сортировки; ключи берутся из кэша таблицы, ФС не читается."""
+        anchor = self._cursor_row()
+        self.sort_mode = SORT_MODES[(SORT_MODES.index(self.sort_mode) + 1) % len(SORT_MODES)]
+        self._build_views()
+        self._move_cursor_to_row(anchor)
+
+    def _attach_row(self, row):
+        """Вставляет строку в представления; курсор остаётся на том же файле."""
+        hidden = self.table.names[row].startswith('.')
+        for view in (self.view_all, self.view_visible, self.view_prefix):
+            # table.order уже обновлён самой таблицей
+            if view is None or view.rows is self.table.order or (hidden and view is self.view_visible):
+                continue
+            view.add_row(row)
+        pos = self.files.find_row(row)
+        if pos >= 0:
+            if pos <= self.cursor_pos and len(self.files) > 1:
+                self.cursor_pos += 1
+                if pos < self.offset:
+                    self.offset += 1
+            self._scroll_to_cursor()
+
+    def _detach_row(self, row):
+        """Убирает строку из представлений (кроме table.order); курсор остаётся на том же файле."""
+        pos = self.files.find_row(row)
+        for view in (self.view_all, self.view_visible, self.view_prefix):
+            if view is not None and view.rows is not self.table.order:
+                view.discard_row(row)
+        if pos >= 0:
+            if pos < self.cursor_pos:
+                self.cursor_pos -= 1
+            if pos < self.offset:
+                self.offset -= 1
+        self.cursor_pos = max(0, min(self.cursor_pos, len(self.files) - 1))
+        self._scroll_to_cursor()
+
+    def _add_entry(self, name):
+        """Добавляет или обновляет запись в отсортированных листингах без перечитывания директории."""
+        try:
+            record = stat_entry(os.path.join(self.current_dir, name))
+        except OSError:
+            # Запись уже исчезла — событие устарело
+            self._remove_entry(name)
+            return
+        if self.loader is not None:
+            self.stream_added.add(name)
+            self.stream_removed.discard(name)
+        row = self.table.find(name)
+        if row < 0:
+            self._attach_row(self.table.insert(name, record))
+        elif self.sort_mode == 'name':
+            self.table.update(row, record)
+        else:
+            # Изменились размер/время/тип — строка может переехать в представлениях
+            follow = row == self._cursor_row()
+            self._detach_row(row)
+            self.table.update(row, record)
+            self._attach_row(row)
+            if follow:
+                self._move_cursor_to_row(row)
+
+    def _remove_entry(self, name):
+        """Удаляет запись из отсортированных листингов без перечитывания директории."""
+        if self.loader is not None:
+            self.stream_removed.add(name)
+            self.stream_added.discard(name)
+        row = self.table.find(name)
+        if row < 0:
+            return
+        self._detach_row(row)
+        self.table.remove(name)
+        self.selected_files.discard(name)
+        self.cursor_pos = max(0, min(self.cursor_pos, len(self.files) - 1))
+        self._scroll_to_cursor()
+
+    def listing_in_sync(self):
+        """
+        Проверка согласованности перед собственной файловой операцией:
+        листинг можно патчить, только если mtime директории не менялся
+        с момента его построения (после применения событий inotify).
+        """
+        self.apply_fs_events()
+        try:
+            return fs_stat(self.current_dir).st_mtime_ns == self.listing_mtime_ns
+        except OSError:
+            return False
+
+    def patch_listing(self, in_sync, added=(), removed=()):
+        """
+        Применяет к листингу результат собственной операции за O(log n + k)
+        вместо полного перечитывания. Если листинг был несогласован или имена
+        выходят за пределы текущей директории, перечитывает её целиком.
+        """
+        names = list(removed) + list(added)
+        if not in_sync or any(os.sep in n or n in ('.', '..') for n in names):
+            self.refresh_listing()
+            return
+        for name in removed:
+            self._remove_entry(name)
+        for name in added:
+            self._add_entry(name)
+        try:
+            self.listing_mtime_ns = fs_stat(self.current_dir).st_mtime_ns
+        except OSError:
+            self.refresh_listing()
+
+    def refresh_listing(self):
+        """Полностью перечитывает текущую директорию, оставляя курсор на том же файле."""
+        anchor = self.files[self.cursor_pos] if self.cursor_pos < len(self.files) else None
+        self.listing_dir = None
+        self.listing_cache.discard(self.current_dir)
+        self.get_files()
+        if anchor is not None and self.files.find(anchor) >= 0:
+            self.cursor_pos = self.files.find(anchor)
+        self.cursor_pos = max(0, min(self.cursor_pos, len(self.files) - 1))
+        self._scroll_to_cursor()
+
+    def _move_cursor_to(self, name):
+        pos = self.files.find(name)
+        if pos >= 0:
+            self.cursor_pos = pos
+            self._scroll_to_cursor()
+
+    def _scroll_to_cursor(self):
+        """Сдвигает offset так, чтобы курсор оставался в видимой области."""
+        if self.cursor_pos < self.offset:
+            self.offset = self.cursor_pos
+        elif self.cursor_pos >= self.offset + self.max_items:
+            self.offset = max(0, self.cursor_pos - self.max_items + 1)
+
+    def apply_fs_events(self):
+        """
+        Применяет накопившиеся события inotify к листингу текущей директории.
+        Возвращает True, если листинг изменился и нужна перерисовка.
+        """
+        if self.watcher is None or self.listing_dir is None:
+            return False
+        # mtime читаем до событий: всё, что случилось раньше, уже лежит в очереди
+        try:
+            mtime_ns = fs_stat(self.current_dir).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        events = self.watcher.read_events()
+        if not events:
+            return False
+        w = InotifyWatcher
+        relist = mtime_ns is None
+        for mask, name in events:
+            if mask & (w.IN_Q_OVERFLOW | w.IN_DELETE_SELF | w.IN_MOVE_SELF | w.IN_IGNORED):
+                # Наблюдение потеряно или смотрит на директорию, ушедшую с этого пути
+                relist = True
+            elif not name:
+                # Событие самой директории (например, IN_ATTRIB) — листинг не меняется
+                continue
+            elif mask & (w.IN_DELETE | w.IN_MOVED_FROM):
+                self._remove_entry(name)
+            elif mask & (w.IN_CREATE | w.IN_MOVED_TO | w.IN_ATTRIB | w.IN_CLOSE_WRITE):
+                self._add_entry(name)
+        if relist:
+            self.save_current_cursor_position()
+            self.listing_dir = None
+            # Наблюдение ставим заново на то, что теперь лежит по этому пути
+            self.watcher.unwatch()
+            # Текущая директория могла быть удалена — поднимаемся к существующему предку
+            while not os.path.isdir(self.current_dir) and os.path.dirname(self.current_dir) != self.current_dir:
+                self.current_dir = os.path.dirname(self.current_dir)
+            self.get_files()
+            self.restore_cursor_position()
+        else:
+            self.listing_mtime_ns = mtime_ns
+        return True
 
     def load_cursor_positions(self):
         """Загружает сохраненные позиции курсора из файла."""
@@ -89,106 +2379,314 @@ class FileManager:
 
     def save_cursor_positions(self):
         """Сохраняет текущие позиции курсора в файл."""
+        if not self.persist:
+            return
         try:
             with open(CURSOR_POSITIONS_FILE, 'w', encoding='utf-8') as f:
                 json.dump(self.cursor_positions, f, ensure_ascii=False, indent=2)
         except Exception:
             pass
 
+    def session_start(self):
+        """Начало сессии для записи: директория, размер экрана и сохранённые позиции курсора."""
+        return {'dir': self.current_dir, 'size': [self.height, self.width],
+                'positions': self.cursor_positions}
+
+    def session_state(self):
+        """Директория и позиция курсора: итог сессии для сверки записи с воспроизведением."""
+        return {'dir': self.current_dir, 'cursor': self.cursor_pos}
+
     def save_current_cursor_position(self):
         """Сохраняет текущую позицию курсора для текущей директории."""
+        pending = self.pending_cursor
+        if pending is not None and self.cursor_pos == pending[1]:
+            # Сохранённая позиция ещё не дочитана: она и остаётся
+            self.cursor_positions[self.current_dir] = pending[0]
+            return
         self.cursor_positions[self.current_dir] = {
             'cursor_pos': self.cursor_pos,
             'offset': self.offset
         }
 
     def restore_cursor_position(self):
-        """Восстанавливает позицию курсора для текущей директории."""
+        """
+        Восстанавливает позицию курсора для текущей директории. Если листинг
+        ещё читается, сохранённая позиция (номер строки полного листинга)
+        применяется заново после каждой порции в _merge_loaded, пока
+        пользователь не сдвинет курсор.
+        """
+        self.pending_cursor = None
         if self.current_dir in self.cursor_positions:
             saved_pos = self.cursor_positions[self.current_dir]
-            self.cursor_pos = min(saved_pos['cursor_pos'], len(self.files) - 1)
-            self.offset = saved_pos['offset']
-            # Корректируем offset если курсор не виден
-            if self.cursor_pos < self.offset:
-                self.offset = self.cursor_pos
-            elif self.cursor_pos >= self.offset + self.max_items:
-                self.offset = max(0, self.cursor_pos - self.max_items + 1)
+            self.jump_to(saved_pos['cursor_pos'], saved_pos['offset'])
+            if self.loader is not None:
+                self.pending_cursor = (saved_pos, self.cursor_pos)
+
+    def jump_to(self, pos, offset=None):
+        """
+        Ставит курсор на позицию pos и сразу вычисляет offset, без пошагового
+        сдвига: offset ограничивается концом листинга, а если курсор при нём
+        не виден (или offset не задан), окно сдвигается ровно до курсора.
+        """
+        count = len(self.files)
+        self.cursor_pos = max(0, min(pos, count - 1))
+        if offset is not None:
+            self.offset = max(0, min(offset, count - self.max_items))
+        self._scroll_to_cursor()
+
+    def page_down(self):
+        """Перелистывает на экран вниз: курсор и окно сдвигаются вместе."""
+        self.jump_to(self.cursor_pos + self.max_items, self.offset + self.max_items)
+
+    def page_up(self):
+        """Перелистывает на экран вверх."""
+        self.jump_to(self.cursor_pos - self.max_items, self.offset - self.max_items)
+
+    def type_ahead(self):
+        """
+        Режим поиска по префиксу: каждый набранный символ переносит курсор
+        на первое имя с этим префиксом. Enter/Esc завершают поиск, любая
+        другая спецклавиша завершает его и обрабатывается как обычно.
+        """
+        if self.view_prefix is None:
+            self.view_prefix = self.table.prefix_index()
+        self.typeahead = TypeAhead(self.view_prefix)
+        try:
+            while True:
+                self.draw()
+                ch = self.screen.get_wch()
+                if ch in ("\n", "\r", "\x1b"):
+                    break
+                if ch == curses.KEY_RESIZE:
+                    self.relayout()
+                    continue
+                if ch in ("\b", "\x7f") or ch == curses.KEY_BACKSPACE:
+                    self.typeahead.pop()
+                elif isinstance(ch, str) and ch.isprintable():
+                    self.typeahead.push(ch)
+                else:
+                    self.pending_key = ch
+                    break
+                row = self.typeahead.match_row()
+                # Скрытые имена вне представления: без показа скрытых их не ищем
+                pos = self.files.find_row(row) if row >= 0 else -1
+                if pos >= 0:
+                    self.jump_to(pos)
+        finally:
+            self.typeahead = None
+            self.needs_redraw = True
+
+    def fuzzy_filter(self):
+        """
+        Режим нечёткого фильтра: показываются только имена, содержащие
+        набранные символы по порядку. ↑/↓ ходят по совпадениям, Enter ставит
+        курсор на выбранный файл в полном списке, → ещё и открывает его,
+        Esc возвращает курсор на прежнее место.
+        """
+        base = self.files
+        saved = (self.cursor_pos, self.offset)
+        chosen = -1
+        self.fuzzy = FuzzyFilter(base)
+        self.cursor_pos = self.offset = 0
+        try:
+            while True:
+                self.files = self.fuzzy.result()
+                self.jump_to(self.cursor_pos)
+                self.draw()
+                # Пока идёт фоновая фильтрация, ждём клавишу с тайм-аутом
+                self.screen.timeout(FILTER_POLL_MS if self.fuzzy.running else -1)
+                try:
+                    ch = self.screen.get_wch()
+                except curses.error:
+                    self.fuzzy.poll()
+                    continue
+                finally:
+                    self.screen.timeout(-1)
+                if ch == "\x1b":
+                    break
+                if ch in ("\n", "\r", curses.KEY_RIGHT):
+                    chosen = self._cursor_row()
+                    if ch == curses.KEY_RIGHT:
+                        self.pending_key = ch
+                    break
+                if ch in ("\b", "\x7f") or ch == curses.KEY_BACKSPACE:
+                    self.fuzzy.pop()
+                    self.cursor_pos = 0
+                elif ch == curses.KEY_RESIZE:
+                    self.relayout()
+                elif ch == curses.KEY_UP:
+                    self.cursor_pos -= 1
+                elif ch == curses.KEY_DOWN:
+                    self.cursor_pos += 1
+                elif isinstance(ch, str) and ch.isprintable():
+                    self.fuzzy.push(ch)
+                    self.cursor_pos = 0
+                self.fuzzy.poll()
+        finally:
+            self.fuzzy.cancel()
+            self.fuzzy = None
+            self.files = base
+            if chosen >= 0:
+                self._move_cursor_to_row(chosen)
+            else:
+                self.jump_to(*saved)
+            self.needs_redraw = True
 
-    def draw(self):
-        self.stdscr.clear()
-        self.height, self.width = self.stdscr.getmaxyx()
-        self.max_items = self.height - 3
+    def jump_to_percent(self):
+        """Переходит к позиции, заданной процентом от длины листинга."""
+        answer = self.get_input("Перейти к, %: ").strip().rstrip('%')
+        if not answer:
+            return
+        try:
+            percent = max(0.0, min(100.0, float(answer)))
+        except ValueError:
+            self.show_message(f"Некорректный процент: {answer}")
+            return
+        pos = int((len(self.files) - 1) * percent / 100)
+        # Цель ставим в середину экрана
+        self.jump_to(pos, pos - self.max_items // 2)
+
+    def relayout(self):
+        """
+        Пересчитывает размеры экрана после KEY_RESIZE (только тогда) и
+        оставляет курсор видимым. Обрезанные имена пересчитываются лениво,
+        при отрисовке видимых строк, когда table.display увидит новую ширину.
+        """
+        self.height, self.width = self.screen.getmaxyx()
+        self.max_items = max(1, self.height - 3)
+        self.jump_to(self.cursor_pos, self.offset)
+        self.invalidate_screen(full=True)
 
+    def draw(self):
+        stats = self.stats
+        if stats is not None:
+            started = time.perf_counter_ns()
         # Заголовок + информация о буфере
         clipboard_info = ""
         if self.clipboard:
             clipboard_info = f" | Clipboard: {len(self.clipboard)} item(s) [{self.clipboard_action}]"
-        header = f" GFD - {self.current_dir} {clipboard_info} "
-        try:
-            self.stdscr.addstr(0, 0, header[:self.width-1], curses.A_NORMAL)
-        except curses.error:
-            pass
-
-        # Список файлов
+        loading_info = ""
+        if self.loader is not None:
+            loading_info = f" | loading {self.loader.count}…"
+        sort_info = ""
+        if self.sort_mode != 'name':
+            sort_info = f" | sort: {SORT_TITLES[self.sort_mode]}"
+        jobs_info = ""
+        if self.jobs:
+            jobs_info = f" | jobs: {len(self.jobs)}"
+        header = f" GFD - {self.current_dir} {clipboard_info}{sort_info}{loading_info}{jobs_info} "
+        # Строки кадра: y -> (текст, атрибут); рисуются только отличающиеся от экрана
+        lines = {0: (fit_width(header, self.width-1), curses.A_NORMAL)}
+
+        # Список файлов: цвет и обрезанное имя берутся из кэша таблицы
+        table = self.files.table
+        rows = self.files.rows
         line = 2
         for i in range(self.offset, min(len(self.files), self.offset + self.max_items)):
-            file_name = self.files[i]
-            full_path = os.path.join(self.current_dir, file_name)
-
-            # Определяем цвет строки (для курсора и выделенных)
+            row = rows[i]
             if i == self.cursor_pos:
-                attr = curses.color_pair(1) # Курсор
-            elif file_name in self.selected_files:
-                attr = curses.color_pair(5) # Выделенные
-            else:
-                attr = curses.A_NORMAL # По умолчанию для строки, если не курсор и не выделено
-
-            # Определяем цвет текста файла
-            if os.path.isdir(full_path) or file_name == "..":
-                file_attr = curses.color_pair(2)  # Директории
-            elif os.path.islink(full_path):
-                file_attr = curses.color_pair(4)  # Ссылки
-            elif os.access(full_path, os.X_OK):
-                file_attr = curses.color_pair(3)  # Исполняемые
+                attr = self.screen.color_pair(1) # Курсор
+            elif self.selected_files and table.names[row] in self.selected_files:
+                attr = self.screen.color_pair(5) # Выделенные
             else:
-                file_attr = curses.color_pair(10) # <--- ЗДЕСЬ назначаем цвет для обычных файлов
-            # Отрисовка строки
+                attr = self.screen.color_pair(table.colors[row])
+            lines[line] = (table.display(row, self.width-1), attr)
+            line += 1
+
+        if self.typeahead is not None:
+            status = f"Поиск: {self.typeahead.prefix}"
+            if self.typeahead.match_row() < 0:
+                status += "  (нет совпадений)"
+            lines[self.height - 1] = (status[:self.width-1], curses.A_BOLD)
+        elif self.fuzzy is not None:
+            status = f"Фильтр: {self.fuzzy.query}  ({len(self.files)}"
+            status += " совпадений, поиск…)" if self.fuzzy.running else " совпадений)"
+            lines[self.height - 1] = (status[:self.width-1], curses.A_BOLD)
+        elif stats is not None:
+            lines[self.height - 1] = (fit_width(stats.summary(), self.width-1), self.screen.color_pair(9))
+        elif self.jobs:
+            status = self.jobs.active[0].status()
+            if len(self.jobs) > 1:
+                status = f"[+{len(self.jobs) - 1}] {status}"
+            lines[self.height - 1] = (fit_width(status, self.width-1), self.screen.color_pair(9))
+
+        if stats is None:
+            self.render_lines(lines)
+            return
+        composed = time.perf_counter_ns()
+        stats.add('draw', composed - started)
+        self.render_lines(lines)
+        stats.add('term', time.perf_counter_ns() - composed)
+
+    def render_lines(self, lines):
+        """
+        Переносит кадр на экран, обновляя только строки, которые изменились
+        с прошлого кадра (перемещение курсора — две строки), и отправляет
+        изменения в терминал одним doupdate.
+        """
+        shown = self.screen_lines
+        for y in range(self.height):
+            want = lines.get(y)
+            if shown.get(y) == want:
+                continue
             try:
-                if i == self.cursor_pos or file_name in self.selected_files:
-                    self.stdscr.addstr(line, 0, file_name[:self.width-1], attr)
-                else:
-                    self.stdscr.addstr(line, 0, file_name[:self.width-1], file_attr)
+                self.screen.move(y, 0)
+                self.screen.clrtoeol()
+                if want is not None:
+                    self.screen.addstr(y, 0, want[0], want[1])
             except curses.error:
                 pass
-
-            line += 1
-
-        self.stdscr.refresh()
+            if want is None:
+                shown.pop(y, None)
+            else:
+                shown[y] = want
+        self.screen.noutrefresh()
+        self.screen.doupdate()
+
+    def invalidate_screen(self, full=False):
+        """
+        Сбрасывает теневой буфер после того, как поверх кадра рисовали
+        сообщения, ввод или popup: следующий draw перерисует все строки.
+        full=True заставляет curses перерисовать терминал целиком.
+        """
+        self.screen_lines = {}
+        if full:
+            self.screen.clear()
+        else:
+            self.screen.erase()
+        self.needs_redraw = True
 
     def show_message(self, message, wait=True, timeout=None):
-                y = self.height // 2
-                # центрируем по первой строке (если многострочное, рисуем с последующей строкой)
-                lines = message.splitlines() or [""]
-                x = max(0, self.width // 2 - max(len(l) for l in lines) // 2)
-                try:
-                    for i, line in enumerate(lines):
-                        self.stdscr.addstr(y + i, x, line[:self.width-1], curses.A_BOLD)
-                    self.stdscr.refresh()
-                    if timeout is not None:
-                        curses.napms(int(timeout * 1000))  # ждём timeout секунд
-                    elif wait:
-                        self.stdscr.get_wch()  # старое поведение — ждать клавишу
-                except curses.error:
-                    pass
+                while True:
+                    y = self.height // 2
+                    # центрируем по первой строке (если многострочное, рисуем с последующей строкой)
+                    lines = message.splitlines() or [""]
+                    x = max(0, self.width // 2 - max(len(l) for l in lines) // 2)
+                    try:
+                        for i, line in enumerate(lines):
+                            self.screen.addstr(y + i, x, line[:self.width-1], curses.A_BOLD)
+                        self.screen.refresh()
+                        if timeout is not None:
+                            self.screen.napms(int(timeout * 1000))  # ждём timeout секунд
+                        elif wait:
+                            # старое поведение — ждать клавишу; KEY_RESIZE клавишей не считается
+                            if self.screen.get_wch() == curses.KEY_RESIZE:
+                                self.relayout()
+                                self.draw()
+                                continue
+                    except curses.error:
+                        pass
+                    break
+                self.invalidate_screen()
 
     def get_input(self, prompt):
             """
             Безопасный ввод строки внизу экрана.
             Рисуем только видимую часть (хвост) строки, очищаем остаток строки и явно перемещаем курсор.
             """
-            curses.curs_set(1)
+            self.screen.curs_set(1)
             # Отключаем автоматическое эхо (мы сами рисуем ввод)
-            curses.noecho()
+            self.screen.noecho()
             y = self.height - 3
             buffer = []
             try:
@@ -200,19 +2698,23 @@ class FileManager:
                     visible = full[-max_input:] if max_input > 0 else ""
         
                     try:
-                        self.stdscr.move(y, 0)
-                        self.stdscr.clrtoeol()
+                        self.screen.move(y, 0)
+                        self.screen.clrtoeol()
                         # рисуем prompt + видимую часть (ограничиваем длину)
-                        self.stdscr.addnstr(y, 0, prompt + visible, self.width - 1)
+                        self.screen.addnstr(y, 0, prompt + visible, self.width - 1)
                         # ставим курсор после видимой части
                         cursor_x = min(len(prompt) + len(visible), max(0, self.width - 1))
-                        self.stdscr.move(y, cursor_x)
-                        self.stdscr.refresh()
+                        self.screen.move(y, cursor_x)
+                        self.screen.refresh()
                     except curses.error:
                         pass
         
-                    ch = self.stdscr.get_wch()
+                    ch = self.screen.get_wch()
         
+                    if ch == curses.KEY_RESIZE:
+                        self.relayout()
+                        y = self.height - 3
+                        continue
                     # Enter
                     if ch in ("\n", "\r"):
                         break
@@ -235,9 +2737,10 @@ class FileManager:
             finally:
                 # всегда скрываем курсор после ввода
                 try:
-                    curses.curs_set(0)
+                    self.screen.curs_set(0)
                 except curses.error:
                     pass
+                self.invalidate_screen()
         
             return "".join(buffer)
 
@@ -249,6 +2752,12 @@ class FileManager:
             "",
             "НАВИГАЦИЯ:",
             "  ↑/↓     - Перемещение курсора",
+            "  PgUp/PgDn - На экран вверх/вниз",
+            "  Home/End  - В начало/конец списка",
+            "  %       - Перейти к позиции в процентах",
+            "  f       - Поиск по началу имени (Enter/Esc - выход)",
+            "  /       - Фильтр: только имена с набранными символами",
+            "            (Enter - перейти, → - открыть, Esc - отмена)",
             "  ←       - Назад в родительскую директорию", 
             "  →/Enter - Открыть файл/директорию",
             "",
@@ -263,9 +2772,14 @@ class FileManager:
             "  d       - Удалить файл/директорию",
             "  r       - Переименовать файл/директорию",
             "  n       - Создать новый файл/директорию",
+            "  Esc     - Отменить фоновую вставку",
             "",
             "НАСТРОЙКИ:",
             "  .       - Показать/скрыть скрытые файлы",
+            "  R       - Перечитать директорию",
+            "  s       - Сменить сортировку (имя, естеств., расширение,",
+            "            размер, время, сначала директории)",
+            "  D       - Панель времени кадра (p50/p99 по фазам)",
             "",
             "СИСТЕМА:",
             "  h       - Показать эту справку",
@@ -274,51 +2788,186 @@ class FileManager:
             "Нажмите любую клавишу для закрытия..."
         ]
         
-        # Вычисляем размеры окна
-        max_width = max(len(line) for line in help_lines) + 4
-        height = len(help_lines) + 2
+        while True:
+            # Вычисляем размеры окна
+            max_width = max(len(line) for line in help_lines) + 4
+            height = len(help_lines) + 2
         
-        # Центрируем окно
-        start_y = max(0, (self.height - height) // 2)
-        start_x = max(0, (self.width - max_width) // 2)
+            # Центрируем окно
+            start_y = max(0, (self.height - height) // 2)
+            start_x = max(0, (self.width - max_width) // 2)
         
-        # Создаем окно помощи
-        help_win = curses.newwin(height, max_width, start_y, start_x)
-        help_win.border()
-        help_win.bkgd(' ', curses.color_pair(9))  # Используем цвет для сообщений
+            # Создаем окно помощи
+            help_win = self.screen.popup(height, max_width, start_y, start_x)
+            help_win.border()
+            help_win.bkgd(' ', self.screen.color_pair(9))  # Используем цвет для сообщений
         
-        # Заполняем окно текстом
-        for i, line in enumerate(help_lines):
-            try:
-                # Выравниваем по левому краю с отступом
-                x_pos = 2  # Отступ от левого края
-                help_win.addstr(i + 1, x_pos, line[:max_width-4])
-            except curses.error:
-                pass
+            # Заполняем окно текстом
+            for i, line in enumerate(help_lines):
+                try:
+                    # Выравниваем по левому краю с отступом
+                    x_pos = 2  # Отступ от левого края
+                    help_win.addstr(i + 1, x_pos, line[:max_width-4])
+                except curses.error:
+                    pass
         
-        # Отображаем окно
-        help_win.refresh()
+            # Отображаем окно
+            help_win.refresh()
         
-        # Ждем нажатия любой клавиши
-        self.stdscr.get_wch()
+            # Ждем нажатия любой клавиши; при изменении размера перестраиваем экран и окно
+            if self.screen.get_wch() != curses.KEY_RESIZE:
+                break
+            # Старое окно не чистим: оно могло оказаться за краем экрана, relayout перерисует всё
+            del help_win
+            self.relayout()
+            self.draw()
         
         # Очищаем окно
         help_win.clear()
         help_win.refresh()
         del help_win
+        self.invalidate_screen()
+
+    def read_key(self):
+        """
+        Ждёт клавишу; если есть фоновая работа (чтение директории, inotify,
+        предварительное чтение), возвращает None по тайм-ауту опроса.
+        """
+        if self.pending_key is not None:
+            key, self.pending_key = self.pending_key, None
+        else:
+            key = self._wait_key()
+        if self.stats is not None:
+            self.stats.frame_begin()
+        return key
+
+    def _wait_key(self):
+        poll_ms = self._poll_timeout_ms()
+        if poll_ms is None:
+            return self.screen.get_wch()
+        self.screen.timeout(poll_ms)
+        try:
+            return self.screen.get_wch()
+        except curses.error:
+            return None
+        finally:
+            self.screen.timeout(-1)
+
+    def coalesce_arrows(self, key):
+        """
+        Применяет стрелку key и все стрелки вверх/вниз, уже ждущие во входном
+        буфере, за один кадр: удержание клавиши даёт один кадр на пачку
+        повторов, и курсор останавливается сразу, как клавишу отпустили.
+        Клавиши из буфера сдвигают курсор на строку каждая, как отдельные
+        нажатия: когда их нажали, неизвестно, поэтому ускорение (_repeat_step)
+        считается только для клавиши, дождавшейся чтения. Первая другая
+        клавиша откладывается в pending_key. Возвращает новую позицию курсора.
+        """
+        last = len(self.files) - 1
+        pos = self.cursor_pos
+        step = self._repeat_step(key)
+        self.screen.nodelay(True)
+        try:
+            while True:
+                pos += -step if key == curses.KEY_UP else step
+                pos = max(0, min(last, pos))
+                try:
+                    key = self.screen.get_wch()
+                except curses.error:
+                    break
+                if key not in (curses.KEY_UP, curses.KEY_DOWN):
+                    self.pending_key = key
+                    break
+                step = 1
+        finally:
+            self.screen.nodelay(False)
+        return pos
+
+    def _repeat_step(self, key):
+        """
+        Шаг курсора для стрелки, дождавшейся чтения: растёт, пока такие
+        чтения идут чаще KEY_REPEAT_GAP (клавиша удерживается). Время
+        нажатия даёт экран (key_time): при воспроизведении это время из записи.
+        """
+        now = self.screen.key_time()
+        # Отрицательный интервал — смена часов (запись кончилась, ввод живой)
+        if key == self.repeat_key and 0 <= now - self.repeat_time < KEY_REPEAT_GAP:
+            self.repeat_count += 1
+        else:
+            self.repeat_key = key
+            self.repeat_count = 0
+        self.repeat_time = now
+        return min(KEY_ACCEL_MAX, 1 + self.repeat_count // KEY_ACCEL_EVERY)
+
+    def wait_background(self):
+        """Дожидается фонового чтения директории и операций вставки."""
+        if self.loader is not None:
+            self.loader.done.wait()
+        for job in self.jobs.active:
+            job.future.exception()  # ждёт завершения, ошибку заберёт poll_jobs
+
+    def _poll_timeout_ms(self):
+        """Тайм-аут ожидания клавиши в мс или None, если фоновой работы нет."""
+        timeouts = []
+        if self.loader is not None:
+            timeouts.append(STREAM_POLL_MS)
+        if self.watcher is not None:
+            timeouts.append(WATCH_POLL_MS)
+        if self.prefetcher:
+            timeouts.append(PREFETCH_POLL_MS)
+        if self.jobs:
+            timeouts.append(JOB_POLL_MS)
+        if self.prefetch_target is not None:
+            timeouts.append(max(1, int((self.prefetch_due - time.monotonic()) * 1000) + 1))
+        return min(timeouts) if timeouts else None
 
     def handle_input(self):
-        key = self.stdscr.get_wch()
+        key = self.read_key()
+        if key is None:
+            if self.screen.settling():
+                self.wait_background()
+            # Клавиш нет — дочитываем директорию и подхватываем изменения других процессов
+            self.poll_prefetch()
+            loading = self.poll_loader()
+            finished = self.poll_jobs()
+            self.needs_redraw = self.apply_fs_events() or loading or finished
+            return True
+        self.needs_redraw = True
+
+        if key in (curses.KEY_UP, curses.KEY_DOWN):
+            self.cursor_pos = self.coalesce_arrows(key)
+            self._scroll_to_cursor()
+
+        elif key == curses.KEY_NPAGE:
+            self.page_down()
+
+        elif key == curses.KEY_PPAGE:
+            self.page_up()
+
+        elif key == curses.KEY_HOME:
+            self.jump_to(0, 0)
+
+        elif key == curses.KEY_END:
+            self.jump_to(len(self.files) - 1)
+
+        elif key == "%":
+            self.jump_to_percent()
+
+        elif key == "f":
+            self.type_ahead()
+
+        elif key == "/":
+            self.fuzzy_filter()
 
-        if key == curses.KEY_UP:
-            self.cursor_pos = max(0, self.cursor_pos - 1)
-            if self.cursor_pos < self.offset:
-                self.offset = max(0, self.offset - 1)
+        elif key == curses.KEY_RESIZE:
+            self.relayout()
 
-        elif key == curses.KEY_DOWN:
-            self.cursor_pos = min(len(self.files) - 1, self.cursor_pos + 1)
-            if self.cursor_pos >= self.offset + self.max_items:
-                self.offset += 1
+        elif key == "D":
+            self.stats = None if self.stats is not None else FrameStats()
+            FS_CALLS.enabled = self.stats is not None
+
+        elif key == "\x1b":
+            self.cancel_job()
 
         elif key == curses.KEY_LEFT:
             self.navigate_back()
@@ -327,13 +2976,19 @@ class FileManager:
             self.open_selected_item()
 
         elif key == "q":
+            if self.jobs:
+                # Без отмены выход ждёт, пока фоновые операции докопируют всё
+                confirm = self.get_input(
+                    f"Идут фоновые операции ({len(self.jobs)}). Отменить их? (y/n): ")
+                if confirm.lower() == 'y':
+                    self.jobs.cancel_all()
             # Сохраняем текущую позицию курсора
             self.save_current_cursor_position()
             # Сохраняем все позиции в файл
             self.save_cursor_positions()
             
             # Сохраняем текущую директорию для cd on exit, только если она изменилась
-            if self.current_dir != self.last_dir:
+            if self.persist and self.current_dir != self.last_dir:
                 try:
                     with open(CD_FILE, 'w') as f:
                         f.write(self.current_dir)
@@ -350,14 +3005,7 @@ class FileManager:
                     self.selected_files.add(fname)
 
         elif key == ".":
-            # Сохраняем текущую позицию курсора перед переключением
-            self.save_current_cursor_position()
-            
-            self.show_hidden = not self.show_hidden
-            self.get_files()
-            
-            # Восстанавливаем позицию курсора после обновления списка
-            self.restore_cursor_position()
+            self.toggle_hidden()
 
         elif key == "r":
             self.rename_item()
@@ -380,9 +3028,16 @@ class FileManager:
         elif key == "n":
             self.create_new_item()
 
+        elif key == "R":
+            self.refresh_listing()
+
+        elif key == "s":
+            self.cycle_sort_mode()
+
         elif key == "?":
             self.show_help_popup()
 
+        self.schedule_prefetch()
         return True
 
 
@@ -422,7 +3077,7 @@ class FileManager:
     def open_file(self, full_path):
                 try:
                     # Закрываем окно curses, чтобы терминальный редактор правильно работал
-                    curses.endwin()
+                    self.screen.suspend()
             
                     # Предпочитаем редактор из переменной окружения GFD_EDITOR,
                     # затем EDITOR, затем пытаемся использовать 'micro' если он в PATH
@@ -448,9 +3103,11 @@ class FileManager:
                     # Попытка вернуть curses в нормальное состояние
                     try:
                         # иногда достаточно doupdate/refresh
-                        curses.doupdate()
+                        self.screen.doupdate()
                     except Exception:
                         pass
+                    # После внешней программы терминал нужно перерисовать целиком
+                    self.invalidate_screen(full=True)
             
                 except Exception as e:
                     # Если ещё не вышли из curses, покажем сообщение внутри интерфейса
@@ -466,9 +3123,11 @@ class FileManager:
             new_name = self.get_input(f"Переименовать {old_name} в: ")
             if new_name:
                 try:
+                    in_sync = self.listing_in_sync()
                     os.rename(os.path.join(self.current_dir, old_name),
                               os.path.join(self.current_dir, new_name))
-                    self.get_files()
+                    self.patch_listing(in_sync, added=[new_name], removed=[old_name])
+                    self._move_cursor_to(new_name)
                 except Exception as e:
                     self.show_message(f"Ошибка переименования: {e}")
 
@@ -512,65 +3171,86 @@ class FileManager:
         self.clipboard = []
         self.clipboard_action = None
 
-    def _unique_dest(self, dest_path):
-        """Если dest_path существует, возвращает уникальный путь с суффиксом _copy, _copy1, ..."""
-        if not os.path.exists(dest_path):
+    def _unique_dest(self, dest_path, reserved=()):
+        """
+        Если dest_path существует (или занят операцией из reserved), возвращает
+        уникальный путь с суффиксом _copy, _copy1, ...
+        """
+        if not os.path.exists(dest_path) and dest_path not in reserved:
             return dest_path
         base, ext = os.path.splitext(dest_path)
         # для директорий ext == ''
         count = 1
         new_path = f"{base}_copy{ext}"
-        while os.path.exists(new_path):
+        while os.path.exists(new_path) or new_path in reserved:
             new_path = f"{base}_copy{count}{ext}"
             count += 1
         return new_path
 
     def paste_from_clipboard(self):
+        """
+        Проверяет буфер и ставит вставку в фоновую очередь: интерфейс не
+        блокируется на время копирования, листинг патчится по завершении
+        (poll_jobs). Перемещение в пределах одного устройства — это один
+        os.rename, он выполняется сразу; в очередь попадают только
+        перемещения между устройствами.
+        """
         if not self.clipboard:
             self.show_message("Буфер пуст")
             return
 
-        # Пытаемся вставить все элементы в self.current_dir
         errors = []
+        items = []
+        renamed = []
+        in_sync = self.listing_in_sync()
+        try:
+            dest_dev = fs_stat(self.current_dir).st_dev
+        except OSError:
+            dest_dev = None
+        # Имена, уже выданные незавершённым операциям, тоже заняты
+        reserved = self.jobs.reserved()
         for src in self.clipboard:
-            try:
-                if not os.path.exists(src):
-                    errors.append(f"Исходник не найден: {src}")
+            if not os.path.exists(src):
+                errors.append(f"Исходник не найден: {src}")
+                continue
+            name = os.path.basename(src.rstrip(os.sep))
+            dest = os.path.join(self.current_dir, name)
+
+            # Защита: если пытаемся переместить директорию в саму себя (или в его потомка)
+            if self.clipboard_action == 'move':
+                # Если dest начинается с src + os.sep, то запрещаем
+                src_real = os.path.realpath(src)
+                dest_real = os.path.realpath(dest)
+                if dest_real.startswith(src_real + os.sep) or dest_real == src_real:
+                    errors.append(f"Нельзя переместить {name} внутрь него самого")
                     continue
-                name = os.path.basename(src.rstrip(os.sep))
-                dest = os.path.join(self.current_dir, name)
-
-                # Защита: если пытаемся переместить директорию в саму себя (или в его потомка)
-                if self.clipboard_action == 'move':
-                    # Если dest начинается с src + os.sep, то запрещаем
-                    src_real = os.path.realpath(src)
-                    dest_real = os.path.realpath(dest)
-                    if dest_real.startswith(src_real + os.sep) or dest_real == src_real:
-                        errors.append(f"Нельзя переместить {name} внутрь него самого")
-                        continue
 
-                # Получаем уникальное имя, если нужно
-                if os.path.exists(dest):
-                    dest = self._unique_dest(dest)
+            # Получаем уникальное имя, если нужно
+            dest = self._unique_dest(dest, reserved)
 
-                if os.path.isdir(src):
-                    # Копирование/перемещение директорий
-                    if self.clipboard_action == 'copy':
-                        shutil.copytree(src, dest)
-                    else:
-                        shutil.move(src, dest)
-                else:
-                    # Файлы: используем copy2 (копирует метаданные) или move
-                    if self.clipboard_action == 'copy':
-                        shutil.copy2(src, dest)
-                    else:
-                        shutil.move(src, dest)
+            if self.clipboard_action == 'move':
+                try:
+                    if os.lstat(src).st_dev == dest_dev:
+                        os.rename(src, dest)
+                        renamed.append((src, dest))
+                        continue
+                except OSError as e:
+                    # EXDEV: то же st_dev, но разные точки монтирования — копируем
+                    if e.errno != errno.EXDEV:
+                        errors.append(f"{name}: {e}")
+                        continue
 
-            except Exception as e:
-                errors.append(f"{os.path.basename(src)}: {e}")
+            reserved.add(dest)
+            items.append((src, dest))
 
-        # После операции обновляем список
-        self.get_files()
+        if renamed:
+            added = [os.path.basename(dest) for _src, dest in renamed]
+            removed = [os.path.basename(src.rstrip(os.sep)) for src, _dest in renamed
+                       if os.path.dirname(os.path.abspath(src.rstrip(os.sep))) == self.current_dir]
+            self.patch_listing(in_sync, added=added, removed=removed)
+
+        if items:
+            self.jobs.submit(PasteJob(self.clipboard_action, items, self.current_dir))
 
         # Если операция была перемещение — очищаем буфер
         if self.clipboard_action == 'move':
@@ -578,9 +3258,46 @@ class FileManager:
 
         if errors:
             self.show_message("Ошибки:\n" + "\n".join(errors))
-        else:
+        elif renamed and not items:
             self.show_message("Операция выполнена", timeout=0.4)
 
+    def cancel_job(self):
+        """Отменяет самую раннюю из ещё не отменённых фоновых операций."""
+        job = next((job for job in self.jobs.active if not job.cancelled), None)
+        if job is None:
+            return
+        title = "копирование" if job.action == 'copy' else "перемещение"
+        confirm = self.get_input(f"Отменить {title} ({job.current or '…'})? (y/n): ")
+        if confirm.lower() == 'y':
+            job.cancel()
+
+    def poll_jobs(self):
+        """
+        Применяет результаты завершённых фоновых операций: листинг текущей
+        директории патчится только если операция её затронула.
+        Возвращает True, если что-то завершилось или пора обновить прогресс.
+        """
+        finished = self.jobs.collect()
+        # Прогресс перерисовываем не чаще JOB_PROGRESS_INTERVAL
+        progress = False
+        if self.jobs and time.monotonic() - self.progress_drawn >= JOB_PROGRESS_INTERVAL:
+            self.progress_drawn = time.monotonic()
+            progress = True
+        for job in finished:
+            added = job.added if job.dest_dir == self.current_dir else []
+            removed = [name for folder, name in job.removed if folder == self.current_dir]
+            if added or removed:
+                self.patch_listing(self.listing_in_sync(), added=added, removed=removed)
+            if job.errors:
+                self.show_message("Ошибки:\n" + "\n".join(job.errors))
+            elif job.cancelled:
+                self.show_message("Операция отменена", timeout=0.6)
+            elif job.strategies:
+                self.show_message(f"Операция выполнена ({job.strategy_summary()})", timeout=0.6)
+            else:
+                self.show_message("Операция выполнена", timeout=0.4)
+        return bool(finished) or progress
+
     # --- Конец clipboard operations ---
 
     def copy_items(self):
@@ -600,6 +3317,8 @@ class FileManager:
             return
         confirm = self.get_input(f"Удалить {', '.join(targets)}? (y/n): ")
         if confirm.lower() == 'y':
+            in_sync = self.listing_in_sync()
+            removed = []
             for fname in targets:
                 file_to_delete = os.path.join(self.current_dir, fname)
                 try:
@@ -607,9 +3326,10 @@ class FileManager:
                         shutil.rmtree(file_to_delete)
                     else:
                         os.remove(file_to_delete)
-                    self.get_files()
+                    removed.append(fname)
                 except Exception as e:
                     self.show_message(f"Ошибка удаления {fname}: {e}")
+            self.patch_listing(in_sync, removed=removed)
             self.selected_files.clear()
 
     def create_new_item(self):
@@ -618,29 +3338,116 @@ class FileManager:
             create_type = self.get_input("Файл (f) или директория (d)? ")
             if create_type.lower() == 'f':
                 try:
+                    in_sync = self.listing_in_sync()
                     open(os.path.join(self.current_dir, name), 'a').close()
-                    self.get_files()
+                    self.patch_listing(in_sync, added=[name])
                 except Exception as e:
                     self.show_message(f"Ошибка создания файла: {e}")
             elif create_type.lower() == 'd':
                 try:
+                    in_sync = self.listing_in_sync()
                     os.mkdir(os.path.join(self.current_dir, name))
-                    self.get_files()
+                    self.patch_listing(in_sync, added=[name])
                 except Exception as e:
                     self.show_message(f"Ошибка создания директории: {e}")
 
     def run(self):
-        while True:
-            self.draw()
-            if not self.handle_input():
-                break
+        try:
+            while True:
+                if self.needs_redraw:
+                    self.draw()
+                    self.needs_redraw = False
+                    if self.stats is not None:
+                        self.stats.frame_end()
+                if not self.handle_input():
+                    break
+                # Время обработки учитываем только для клавиш, давших новый кадр
+                if self.stats is not None and self.needs_redraw:
+                    self.stats.input_done()
+        except KeyboardInterrupt:
+            # Ctrl-C — не ждать окончания копирования
+            self.jobs.cancel_all()
+            raise
+        finally:
+            if self.jobs:
+                self.show_message(f"Ожидание фоновых операций ({len(self.jobs)})…", wait=False)
+            self.jobs.shutdown()
+            self.prefetcher.shutdown()
+            if self.watcher is not None:
+                self.watcher.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="GFD - текстовый файловый менеджер")
+    parser.add_argument('--record', metavar='FILE',
+                        help="записывать нажатия клавиш сессии в FILE")
+    parser.add_argument('--replay', metavar='FILE',
+                        help="воспроизвести нажатия из FILE, затем продолжить работу")
+    parser.add_argument('--realtime', action='store_true',
+                        help="воспроизводить с исходными паузами между нажатиями")
+    parser.add_argument('--headless', action='store_true',
+                        help="воспроизвести без терминала и вывести задержки клавиш")
+    return parser.parse_args(argv)
+
+
+def main(stdscr, args):
+    screen = CursesScreen(stdscr)
+    replay = None
+    if args.replay:
+        # В терминале запись — макрос: выполняется в текущей директории
+        keys, _start, _end = load_keys(args.replay)
+        screen = replay = ReplayScreen(screen, keys, args.realtime)
+    if args.record:
+        screen = RecordingScreen(screen, args.record)
+    fm = None
+    try:
+        fm = FileManager(screen)
+        if args.record:
+            screen.begin(fm.session_start())
+        fm.run()
+    finally:
+        if args.record:
+            screen.close(fm.session_state() if fm is not None else None)
+    return replay
+
+
+def run_headless(args):
+    """
+    Воспроизводит запись на VirtualScreen в записанных директории и размере
+    экрана и сверяет итог (директорию и позицию курсора) с записанной сессией.
+    """
+    keys, start, end = load_keys(args.replay)
+    if start is not None:
+        lines, columns = start['size']
+    else:
+        columns, lines = shutil.get_terminal_size()
+    replay = ReplayScreen(VirtualScreen(lines, columns), keys, args.realtime,
+                          live=False, expected=end)
+    if start is not None:
+        os.chdir(start['dir'])
+    # Сохранённые позиции оператора не читаем и не перезаписываем: итог зависит только от записи
+    fm = FileManager(replay, persist=False)
+    if start is not None:
+        fm.cursor_positions = dict(start['positions'])
+    try:
+        fm.run()
+    except EOFError:
+        pass
+    replay.check(fm.session_state())
+    return replay
 
-def main(stdscr):
-    fm = FileManager(stdscr)
-    fm.run()
 
 if __name__ == "__main__":
-    curses.wrapper(main)
+    args = parse_args()
+    if args.headless:
+        if not args.replay:
+            sys.exit("--headless требует --replay FILE")
+        replay = run_headless(args)
+    else:
+        replay = curses.wrapper(main, args)
+    if replay is not None:
+        print(replay.report(), file=sys.stderr)
+        if not replay.matches():
+            sys.exit(1)
 
 
 
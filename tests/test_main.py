@@ -0,0 +1,277 @@
+"""Тесты FileManager на VirtualScreen и фоновых файловых операций."""
+
+import argparse
+import curses
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main  # noqa: E402
+
+
+def write(path, data=''):
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def snapshot(top):
+    """Дерево top: относительный путь -> (тип, права, цель ссылки или содержимое, mtime)."""
+    out = {}
+    for dirpath, dirnames, filenames in os.walk(top):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            info = (stat.S_IFMT(st.st_mode), stat.S_IMODE(st.st_mode))
+            if stat.S_ISLNK(st.st_mode):
+                info += (os.readlink(path),)
+            else:
+                info += (st.st_mtime_ns,)
+            if stat.S_ISREG(st.st_mode):
+                with open(path) as f:
+                    info += (f.read(),)
+            out[os.path.relpath(path, top)] = info
+    return out
+
+
+class TempDirTestCase(unittest.TestCase):
+    """Временная директория root, отдельные файлы позиций и последней директории, возврат cwd."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.home = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.home, True)
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        for name, path in (('CURSOR_POSITIONS_FILE', 'positions'), ('CD_FILE', 'last_dir')):
+            patcher = mock.patch.object(main, name, os.path.join(self.home, path))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def manager(self, path, keys=(), height=24, width=80):
+        os.chdir(path)
+        fm = main.FileManager(main.VirtualScreen(height, width, keys))
+        self.addCleanup(fm.prefetcher.shutdown)
+        self.addCleanup(fm.jobs.shutdown)
+        if fm.watcher is not None:
+            self.addCleanup(fm.watcher.close)
+        return fm
+
+
+class FsEventsTest(TempDirTestCase):
+    def test_patched_listing_matches_reread_in_every_sort_mode(self):
+        for mode in main.SORT_MODES:
+            with self.subTest(mode=mode):
+                d = tempfile.mkdtemp(dir=self.root)
+                for i in range(20):
+                    write(os.path.join(d, f'f{i}.{"txt" if i % 2 else "py"}'), 'x' * i)
+                os.mkdir(os.path.join(d, 'sub'))
+                fm = self.manager(d)
+                if fm.watcher is None:
+                    self.skipTest("inotify недоступен")
+                fm.sort_mode = mode
+                fm._build_views()
+                write(os.path.join(d, 'new10.txt'), 'y' * 100)
+                write(os.path.join(d, 'f3.py'), 'z' * 50)
+                os.unlink(os.path.join(d, 'f4.py'))
+                os.rename(os.path.join(d, 'f5.txt'), os.path.join(d, 'a5.txt'))
+                os.mkdir(os.path.join(d, 'dir2'))
+                self.assertTrue(fm.apply_fs_events())
+                patched = list(fm.files)
+                fm.refresh_listing()
+                self.assertEqual(patched, list(fm.files))
+
+    def test_replaced_directory_is_watched_again(self):
+        cur = os.path.join(self.root, 'cur')
+        new = os.path.join(self.root, 'new')
+        os.mkdir(cur)
+        os.mkdir(new)
+        write(os.path.join(new, 'b'))
+        fm = self.manager(cur)
+        if fm.watcher is None:
+            self.skipTest("inotify недоступен")
+        os.rename(cur, os.path.join(self.root, 'old'))
+        os.rename(new, cur)
+        fm.apply_fs_events()
+        write(os.path.join(cur, 'c'))
+        fm.apply_fs_events()
+        self.assertEqual(list(fm.files), ['b', 'c'])
+
+
+class HiddenToggleTest(TempDirTestCase):
+    def test_cursor_stays_on_file(self):
+        for name in ('.a', '.b', 'c', 'd', '.e', 'f'):
+            write(os.path.join(self.root, name))
+        fm = self.manager(self.root)
+        self.assertFalse(fm.show_hidden)
+        fm.cursor_pos = list(fm.files).index('d')
+        fm.toggle_hidden()
+        self.assertEqual(fm.files[fm.cursor_pos], 'd')
+        fm.cursor_pos = list(fm.files).index('.e')
+        fm.toggle_hidden()
+        # Файл под курсором скрылся — курсор на следующем (скрытые сортируются первыми)
+        self.assertEqual(fm.files[fm.cursor_pos], 'c')
+        fm.toggle_hidden()
+        self.assertEqual(fm.files[fm.cursor_pos], 'c')
+
+
+class ParallelCopytreeTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.src = os.path.join(self.root, 'src')
+        os.makedirs(os.path.join(self.src, 'a', 'b', 'c'))
+        os.mkdir(os.path.join(self.src, 'empty'))
+        for i in range(60):
+            d = ('', 'a', os.path.join('a', 'b', 'c'))[i % 3]
+            path = os.path.join(self.src, d, f'f{i}')
+            write(path, 'x' * i)
+            os.utime(path, ns=(10**18 + i, 10**18 + i * 7))
+        os.chmod(os.path.join(self.src, 'f3'), 0o751)
+        os.symlink('a/f1', os.path.join(self.src, 'lnk_file'))
+        os.symlink('a', os.path.join(self.src, 'lnk_dir'))
+        for d in ('a/b/c', 'a/b', 'a', 'empty', ''):
+            os.utime(os.path.join(self.src, d), ns=(10**18, 10**18 + 5))
+
+    def test_same_result_as_copytree(self):
+        for symlinks in (False, True):
+            for workers in (1, 4):
+                with self.subTest(symlinks=symlinks, workers=workers):
+                    ref = os.path.join(self.root, f'ref{symlinks}{workers}')
+                    out = os.path.join(self.root, f'out{symlinks}{workers}')
+                    shutil.copytree(self.src, ref, symlinks=symlinks)
+                    main.parallel_copytree(self.src, out, shutil.copy2, workers=workers,
+                                           symlinks=symlinks)
+                    self.assertEqual(snapshot(ref), snapshot(out))
+                    self.assertEqual(os.stat(ref).st_mtime_ns, os.stat(out).st_mtime_ns)
+
+    def test_zero_workers_copies_in_current_thread(self):
+        ref = os.path.join(self.root, 'ref')
+        out = os.path.join(self.root, 'out')
+        shutil.copytree(self.src, ref, symlinks=True)
+        main.parallel_copytree(self.src, out, shutil.copy2, workers=0, symlinks=True)
+        self.assertEqual(snapshot(ref), snapshot(out))
+
+
+class CancellingJob(main.PasteJob):
+    """PasteJob, который отменяет сам себя после cancel_after скопированных файлов."""
+
+    cancel_after = 5
+
+    def copy_file(self, src, dst):
+        result = super().copy_file(src, dst)
+        self.cancel_after -= 1
+        if self.cancel_after == 0:
+            self.cancel()
+        return result
+
+
+class PasteJobCancelTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.src = os.path.join(self.root, 'src')
+        self.dest = os.path.join(self.root, 'dest')
+        os.mkdir(self.dest)
+        for i in range(5):
+            os.makedirs(os.path.join(self.src, 'tree', f'd{i}'))
+            for j in range(10):
+                write(os.path.join(self.src, 'tree', f'd{i}', f'f{j}'), 'x' * 100)
+        write(os.path.join(self.src, 'later'), 'data')
+
+    def items(self):
+        return [(os.path.join(self.src, name), os.path.join(self.dest, name))
+                for name in ('tree', 'later')]
+
+    def test_copy_cancel_removes_partial_tree(self):
+        job = CancellingJob('copy', self.items(), self.dest)
+        job.run()
+        self.assertTrue(job.cancelled)
+        self.assertEqual(job.added, [])
+        self.assertEqual(job.errors, [])
+        self.assertEqual(os.listdir(self.dest), [])
+
+    def test_move_cancel_keeps_source(self):
+        before = snapshot(self.src)
+        job = CancellingJob('move', self.items(), self.dest)
+        job.run()
+        self.assertTrue(job.cancelled)
+        self.assertEqual(job.removed, [])
+        self.assertEqual(os.listdir(self.dest), [])
+        self.assertEqual(snapshot(self.src), before)
+
+    def test_cancel_before_start(self):
+        job = main.PasteJob('copy', self.items(), self.dest)
+        job.cancel()
+        job.run()
+        self.assertEqual(job.added, [])
+        self.assertEqual(os.listdir(self.dest), [])
+
+    def test_move_does_not_touch_existing_destination(self):
+        os.mkdir(os.path.join(self.dest, 'tree'))
+        write(os.path.join(self.dest, 'tree', 'keep'))
+        job = main.PasteJob('move', self.items()[:1], self.dest)
+        job.run()
+        self.assertEqual(len(job.errors), 1)
+        self.assertEqual(os.listdir(os.path.join(self.dest, 'tree')), ['keep'])
+        self.assertTrue(os.path.isdir(os.path.join(self.src, 'tree')))
+
+
+class RecordReplayTest(TempDirTestCase):
+    def record(self, start, keys, path):
+        os.chdir(start)
+        screen = main.RecordingScreen(main.VirtualScreen(24, 80, keys), path)
+        fm = main.FileManager(screen)
+        screen.begin(fm.session_start())
+        fm.run()
+        screen.close(fm.session_state())
+        return fm.session_state()
+
+    def replay(self, path):
+        args = argparse.Namespace(replay=path, realtime=False)
+        return main.run_headless(args)
+
+    def test_round_trip(self):
+        sub = os.path.join(self.root, 'sub')
+        os.mkdir(sub)
+        for i in range(50):
+            write(os.path.join(sub, f'f{i:02}'))
+        path = os.path.join(self.home, 'rec.jsonl')
+        positions = os.path.join(self.home, 'positions')
+        write(positions, main.json.dumps({sub: {'cursor_pos': 10, 'offset': 0}}))
+        down = curses.KEY_DOWN
+        keys = [curses.KEY_RIGHT] + [down] * 5 + [curses.KEY_LEFT, curses.KEY_RIGHT, 'q']
+        recorded = self.record(self.root, keys, path)
+        self.assertEqual(recorded, {'dir': sub, 'cursor': 15})
+        # Позиции, сохранённые уже после записи (другая сессия), на воспроизведение не влияют
+        saved = main.json.dumps({sub: {'cursor_pos': 40, 'offset': 30}})
+        write(positions, saved)
+        # Дважды: первое воспроизведение не должно менять условия второго
+        for _ in range(2):
+            replay = self.replay(path)
+            self.assertTrue(replay.matches(), replay.report())
+            self.assertEqual(replay.result, recorded)
+        with open(positions) as f:
+            self.assertEqual(f.read(), saved)
+
+    def test_spaced_presses_are_not_accelerated(self):
+        path = os.path.join(self.home, 'rec.jsonl')
+        for i in range(100):
+            write(os.path.join(self.root, f'f{i:03}'))
+        # 30 отдельных нажатий с паузой 0.5 с: на воспроизведении курсор на 30-й строке
+        with open(path, 'w') as f:
+            f.write(main.json.dumps({'start': {'dir': self.root, 'size': [24, 80],
+                                               'positions': {}}}) + '\n')
+            for i in range(30):
+                f.write(main.json.dumps({'t': 0.5 * i, 'code': curses.KEY_DOWN}) + '\n')
+            f.write(main.json.dumps({'end': {'dir': self.root, 'cursor': 30}}) + '\n')
+        replay = self.replay(path)
+        self.assertTrue(replay.matches(), replay.report())
+
+
+if __name__ == '__main__':
+    unittest.main()